@@ -117,6 +117,24 @@ export function getViewSettings(
   return { radiusScale, radiusMinPixels };
 }
 
+async function decodeTile(
+  buffer: ArrayBuffer,
+  tileId: string,
+  metadata: Metadata,
+) {
+  const decoder = new ZSTDDecoder();
+  await decoder.init();
+
+  const expectedSize = metadata.tiles[tileId].uncompressed_size as number;
+
+  const uncompressedBytes = decoder.decode(
+    new Uint8Array(buffer),
+    expectedSize,
+  );
+
+  return load(uncompressedBytes.buffer as ArrayBuffer, ArrowLoader);
+}
+
 export async function loadTileData(
   index: { x: number; y: number; z: number },
   tileUrlMap: TileSource,
@@ -132,19 +150,10 @@ export async function loadTileData(
     throw new Error(`Failed to fetch tile ${tileId}: ${response.statusText}`);
   }
 
-  const compressedArrayBuffer = await response.arrayBuffer();
-  const compressedBytes = new Uint8Array(compressedArrayBuffer);
-
-  const decoder = new ZSTDDecoder();
-  await decoder.init();
-
-  const expectedSize = metadata.tiles[tileId].uncompressed_size as number;
-
-  const uncompressedBytes = decoder.decode(compressedBytes, expectedSize);
-
-  const arrowData = await load(
-    uncompressedBytes.buffer as ArrayBuffer,
-    ArrowLoader,
+  const arrowData = await decodeTile(
+    await response.arrayBuffer(),
+    tileId,
+    metadata,
   );
 
   const foundTimestampCols = arrowData.schema?.fields
@@ -199,19 +208,10 @@ export async function loadQueryData(
       throw new Error(`Failed to fetch tile ${tileId}: ${response.statusText}`);
     }
 
-    const compressedArrayBuffer = await response.arrayBuffer();
-    const compressedBytes = new Uint8Array(compressedArrayBuffer);
-
-    const decoder = new ZSTDDecoder();
-    await decoder.init();
-
-    const expectedSize = metadata.tiles[tileId].uncompressed_size as number;
-
-    const uncompressedBytes = decoder.decode(compressedBytes, expectedSize);
-
-    const arrowData = await load(
-      uncompressedBytes.buffer as ArrayBuffer,
-      ArrowLoader,
+    const arrowData = await decodeTile(
+      await response.arrayBuffer(),
+      tileId,
+      metadata,
     );
 
     const dataCols = arrowData.data as unknown as Columns;
@@ -0,0 +1,358 @@
+import struct
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+unpack_int16 = struct.Struct(">h").unpack_from
+unpack_int32 = struct.Struct(">i").unpack_from
+
+PG_EPOCH_US = 946_684_800_000_000  # 2000-01-01 as unix microseconds
+PG_EPOCH_DAYS = 10_957  # 2000-01-01 as unix days
+
+# udt_name -> big endian wire dtype; widened the same way pa.array() would infer
+# them from python values so shard schemas don't change
+FIXED_WIDTH_TYPES = {
+    "int2": ">i2",
+    "int4": ">i4",
+    "int8": ">i8",
+    "oid": ">u4",
+    "float4": ">f4",
+    "float8": ">f8",
+    "bool": "u1",
+}
+TEXT_TYPES = {"text", "varchar", "bpchar", "name", "citext"}
+TIME_TYPES = {"timestamp", "timestamptz", "date"}
+# pgvector udt_name -> big endian wire dtype of its elements
+VECTOR_TYPES = {"vector": ">f4", "halfvec": ">f2"}
+
+
+class CopyBinaryDecoder:
+    """
+    Decodes a postgres `COPY ... TO STDOUT (FORMAT BINARY)` stream into Arrow
+    record batches.
+
+    The stream is only scanned row by row to find field boundaries; values are
+    then decoded a whole column at a time with numpy. Vectors become a
+    FixedSizeList<float32> (halfvecs FixedSizeList<float16>), uuids are
+    formatted as strings in bulk, and any type without a columnar decoder
+    goes through the connection's psycopg loader.
+    """
+
+    BATCH_BYTES = 64 * 1024**2  # wire bytes per emitted record batch
+
+    def __init__(self, columns, conn=None, batch_bytes=None, loaders=None):
+        """
+        columns: list of (name, udt_name, numeric_precision, numeric_scale)
+        conn:    psycopg connection, only needed for types decoded by psycopg
+        loaders: column index -> psycopg loader, instead of fetching them with conn
+        """
+        self.col_names = [c[0] for c in columns]
+        self.udt_names = [c[1] for c in columns]
+        self.numeric_types = [c[2:4] for c in columns]
+        self.batch_bytes = batch_bytes or self.BATCH_BYTES
+        self.loaders = self._get_loaders(conn) if loaders is None else loaders
+
+        self.done = False
+        self._header_read = False
+        self._pending = b""
+        self._reset_batch()
+
+    def _get_loaders(self, conn):
+        from psycopg.adapt import Transformer
+        from psycopg.pq import Format
+        from psycopg.types import TypeInfo
+
+        loaders = {}
+        for i, udt in enumerate(self.udt_names):
+            if self._columnar(udt):
+                continue
+            if conn is None:
+                raise ValueError(f"no columnar decoder for {udt}, need a connection")
+            info = TypeInfo.fetch(conn, udt)
+            loaders[i] = Transformer(conn).get_loader(info.oid, Format.BINARY)
+        return loaders
+
+    @staticmethod
+    def _columnar(udt):
+        return (
+            udt in FIXED_WIDTH_TYPES
+            or udt in TEXT_TYPES
+            or udt in TIME_TYPES
+            or udt in VECTOR_TYPES
+            or udt == "uuid"
+        )
+
+    def _reset_batch(self):
+        self._fields = [[] for _ in self.col_names]
+        self._batch_rows = 0
+        self._batch_bytes = 0
+
+    def feed(self, data) -> list:
+        """Consume a chunk of the COPY stream, returning any batches that filled up."""
+        # postgres sends one row per CopyData message, so rows rarely straddle chunks
+        buf = self._pending + bytes(data) if self._pending else bytes(data)
+        pos = self._scan(buf)
+        self._pending = buf[pos:]
+
+        if self._batch_bytes >= self.batch_bytes:
+            return [self._build_batch()]
+        return []
+
+    def finish(self) -> list:
+        """Flush whatever is buffered once the stream has ended."""
+        if self._pending:
+            raise ValueError("COPY stream ended in the middle of a row")
+        if self._batch_rows:
+            return [self._build_batch()]
+        return []
+
+    def _scan(self, buf) -> int:
+        """Slice complete rows out of buf, returning where the first partial row starts."""
+        view = memoryview(buf)
+        end = len(buf)
+        pos = 0
+
+        if not self._header_read:
+            if end < 19:
+                return 0
+            if buf[:11] != COPY_SIGNATURE:
+                raise ValueError("not a binary COPY stream")
+            pos = 19 + unpack_int32(buf, 15)[0]  # skip the header extension
+            self._header_read = True
+
+        fields = self._fields
+        num_cols = len(fields)
+        while pos + 2 <= end and not self.done:
+            num_fields = unpack_int16(buf, pos)[0]
+            if num_fields == -1:  # trailer
+                self.done = True
+                return pos + 2
+            if num_fields != num_cols:
+                raise ValueError(f"expected {num_cols} fields, got {num_fields}")
+
+            row_start = pos
+            pos += 2
+            row = []
+            for _ in range(num_fields):
+                if pos + 4 > end:
+                    return row_start
+                length = unpack_int32(buf, pos)[0]
+                pos += 4
+                if length < 0:
+                    row.append(None)
+                    continue
+                if pos + length > end:
+                    return row_start
+                row.append(view[pos : pos + length])
+                pos += length
+
+            for col, val in zip(fields, row):
+                col.append(val)
+            self._batch_rows += 1
+            self._batch_bytes += pos - row_start
+
+        return pos
+
+    def _build_batch(self):
+        import pyarrow as pa
+
+        arrays = [
+            self._build_column(i, values) for i, values in enumerate(self._fields)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, names=self.col_names)
+        self._reset_batch()
+        return batch
+
+    def _build_column(self, i, values):
+        import numpy as np
+        import pyarrow as pa
+
+        udt = self.udt_names[i]
+        n = len(values)
+        valid = np.fromiter((v is not None for v in values), dtype=bool, count=n)
+
+        if i in self.loaders:
+            return self._build_loaded(i, values)
+        if udt in FIXED_WIDTH_TYPES:
+            raw = _fixed_width(values, valid, FIXED_WIDTH_TYPES[udt])
+            if udt == "bool":
+                raw = raw.astype(bool)
+            elif raw.dtype.kind == "f":
+                raw = raw.astype(np.float64)
+            else:
+                raw = raw.astype(np.int64)
+            return pa.array(raw, mask=_mask(valid))
+        if udt in TIME_TYPES:
+            return _build_time(udt, values, valid)
+        if udt in TEXT_TYPES:
+            return _build_strings(values, valid)
+        if udt == "uuid":
+            return _build_uuids(values, valid)
+        wire_dtype = VECTOR_TYPES[udt]
+        value_type = pa.float16() if wire_dtype == ">f2" else pa.float32()
+        return _build_vectors(values, valid, wire_dtype, value_type)
+
+    def _build_loaded(self, i, values):
+        import pyarrow as pa
+        import uuid
+
+        load = self.loaders[i].load
+        py_values = []
+        for v in values:
+            if v is not None:
+                v = load(v)
+                if isinstance(v, uuid.UUID):
+                    v = str(v)
+            py_values.append(v)
+
+        precision, scale = self.numeric_types[i]
+        if self.udt_names[i] == "numeric":
+            # declared precision keeps every batch on the same decimal type
+            if precision and precision <= 38:
+                return pa.array(py_values, type=pa.decimal128(precision, scale or 0))
+            return pa.array(
+                [None if v is None else float(v) for v in py_values],
+                type=pa.float64(),
+            )
+        return pa.array(py_values)
+
+
+def _mask(valid):
+    return None if valid.all() else ~valid
+
+
+def _validity_buffer(valid):
+    import numpy as np
+    import pyarrow as pa
+
+    if valid.all():
+        return None
+    return pa.py_buffer(np.packbits(valid, bitorder="little"))
+
+
+def _fixed_width(values, valid, dtype):
+    """Concatenate fixed width wire values (zeros for nulls) into one numpy array."""
+    import numpy as np
+
+    dtype = np.dtype(dtype)
+    zero = bytes(dtype.itemsize)
+    raw = b"".join(zero if v is None else v for v in values)
+    return np.frombuffer(raw, dtype=dtype)
+
+
+def _build_time(udt, values, valid):
+    import numpy as np
+    import pyarrow as pa
+
+    wire = ">i4" if udt == "date" else ">i8"
+    raw = _fixed_width(values, valid, wire)
+    info = np.iinfo(raw.dtype)
+    valid = valid & (raw != info.max) & (raw != info.min)  # ±infinity become null
+
+    if udt == "date":
+        return pa.array(
+            raw.astype(np.int32) + PG_EPOCH_DAYS, type=pa.date32(), mask=_mask(valid)
+        )
+    tz = "UTC" if udt == "timestamptz" else None
+    return pa.array(
+        raw.astype(np.int64) + PG_EPOCH_US,
+        type=pa.timestamp("us", tz=tz),
+        mask=_mask(valid),
+    )
+
+
+def _build_strings(values, valid):
+    import numpy as np
+    import pyarrow as pa
+
+    lengths = np.fromiter(
+        (0 if v is None else len(v) for v in values), dtype=np.int64, count=len(values)
+    )
+    offsets = np.zeros(len(values) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    data = b"".join(v for v in values if v is not None)
+
+    arr = pa.Array.from_buffers(
+        pa.string(),
+        len(values),
+        [_validity_buffer(valid), pa.py_buffer(offsets), pa.py_buffer(data)],
+    )
+    arr.validate(full=True)  # postgres text should already be utf-8
+    return arr
+
+
+def _build_uuids(values, valid):
+    import numpy as np
+    import pyarrow as pa
+
+    n = len(values)
+    raw = b"".join(v for v in values if v is not None)
+    hex_digits = np.frombuffer(raw.hex().encode("ascii"), dtype=np.uint8).reshape(
+        -1, 32
+    )
+
+    # 8-4-4-4-12 layout of the canonical string form
+    out = np.full((len(hex_digits), 36), ord("-"), dtype=np.uint8)
+    out[:, 0:8] = hex_digits[:, 0:8]
+    out[:, 9:13] = hex_digits[:, 8:12]
+    out[:, 14:18] = hex_digits[:, 12:16]
+    out[:, 19:23] = hex_digits[:, 16:20]
+    out[:, 24:36] = hex_digits[:, 20:32]
+
+    offsets = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(valid * 36, out=offsets[1:])
+
+    return pa.Array.from_buffers(
+        pa.string(),
+        n,
+        [_validity_buffer(valid), pa.py_buffer(offsets), pa.py_buffer(out.tobytes())],
+    )
+
+
+def _build_vectors(values, valid, wire_dtype, value_type):
+    """pgvector's binary form is int16 dim, int16 unused, then dim big endian floats."""
+    import numpy as np
+    import pyarrow as pa
+
+    itemsize = np.dtype(wire_dtype).itemsize
+    lengths = {len(v) for v in values if v is not None}
+
+    if len(lengths) <= 1:
+        dim = (lengths.pop() - 4) // itemsize if lengths else 0
+        flat = np.zeros((len(values), dim), dtype=value_type.to_pandas_dtype())
+        for i, v in enumerate(values):
+            if v is not None:
+                flat[i] = np.frombuffer(v, dtype=wire_dtype, offset=4)
+        return pa.Array.from_buffers(
+            pa.list_(value_type, dim),
+            len(values),
+            [_validity_buffer(valid)],
+            children=[pa.array(flat.ravel(), type=value_type)],
+        )
+
+    # unconstrained vector columns can mix dimensions
+    raw = b"".join(v[4:] for v in values if v is not None)
+    flat = np.frombuffer(raw, dtype=wire_dtype).astype(value_type.to_pandas_dtype())
+    dims = np.fromiter(
+        (0 if v is None else (len(v) - 4) // itemsize for v in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    offsets = np.zeros(len(values) + 1, dtype=np.int32)
+    np.cumsum(dims, out=offsets[1:])
+    return pa.ListArray.from_arrays(
+        pa.array(offsets), pa.array(flat, type=value_type), mask=pa.array(~valid)
+    )
+
+
+async def get_loaders_async(columns, conn):
+    """CopyBinaryDecoder's psycopg loaders, fetched over an AsyncConnection."""
+    from psycopg.adapt import Transformer
+    from psycopg.pq import Format
+    from psycopg.types import TypeInfo
+
+    loaders = {}
+    for i, udt in enumerate(c[1] for c in columns):
+        if CopyBinaryDecoder._columnar(udt):
+            continue
+        info = await TypeInfo.fetch(conn, udt)
+        loaders[i] = Transformer(conn).get_loader(info.oid, Format.BINARY)
+    return loaders
@@ -1,5 +1,232 @@
+class PointColumns:
+    """x, y and row-index columns shared by every node of a QuadTree."""
+
+    EXTENT = 100.0
+    DENSITY_GRID = 1024  # cells per axis of the density histogram
+    DENSITY_K = 8  # keeps densities on the scale of the old 8-NN estimate
+    DENSITY_CHUNK_ROWS = 1 << 20  # rows binned at a time into the histogram
+
+    SNAP_NEIGHBORS = 1  # first k to search for a point inside the node
+    MAX_SNAP_NEIGHBORS = 64
+
+    def __init__(self, x, y, row_index, density_grid=None, index_positions=None):
+        self.x = x
+        self.y = y
+        self.row_index = row_index
+        self.density_grid = density_grid
+        # sorted positions covered by the shared spatial index, None for all
+        self.index_positions = index_positions
+        self._index = None
+        self._slots = None
+
+        self.path = None  # xy.arrow the columns were mapped from
+        self.pool = None  # process pool building subtrees at pool_depth
+        self.pool_depth = None
+        self.spill_dir = None  # out of core builds keep big partitions here
+        self.spill_rows = None  # longest partition kept in memory
+
+    @classmethod
+    def from_arrow(cls, xy_path, **kwargs):
+        """Memory-map the columns of xy.arrow instead of copying them into python."""
+        import pyarrow as pa, pyarrow.ipc as ipc
+
+        table = ipc.open_file(pa.memory_map(xy_path, "r")).read_all()
+        points = cls(
+            *(
+                table.column(name).combine_chunks().to_numpy()
+                for name in ("x", "y", "row-index")
+            ),
+            **kwargs,
+        )
+        points.path = xy_path
+        return points
+
+    def __len__(self):
+        return len(self.x)
+
+    def spills(self, n):
+        return self.spill_dir is not None and n > self.spill_rows
+
+    def chunks(self, n):
+        """(lo, hi) ranges covering n rows, at most spill_rows long when out of core."""
+        step = self.spill_rows if self.spills(n) else max(n, 1)
+        return [(lo, min(lo + step, n)) for lo in range(0, n, step)]
+
+    def spill_file(self):
+        import os, tempfile
+
+        fd, path = tempfile.mkstemp(dir=self.spill_dir, suffix=".bin")
+        os.close(fd)
+        return path
+
+    def map_spill(self, path):
+        """Memory-map a finished spill file. It is unlinked right away; the mapping keeps it alive."""
+        import os
+        import numpy as np
+
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+            return np.empty(0, dtype=np.int64)
+        positions = np.memmap(path, dtype=np.int64, mode="r")
+        os.remove(path)
+        return positions
+
+    def for_subtree(self, positions):
+        """
+        The columns to build a subtree over positions with. Out of core, the
+        first subtree down a branch that fits in memory gets a KD-tree over just
+        its own points, as pool workers do, instead of one over every point.
+        """
+        import copy
+        import numpy as np
+
+        if self.spill_dir is None or self._index is not None or self.spills(len(positions)):
+            return self
+        points = copy.copy(self)
+        points.index_positions = np.sort(positions)
+        return points
+
+    def release(self):
+        """Drop the KD-tree once the subtree using it is built."""
+        self._index = self._slots = self.index_positions = None
+
+    def all_positions(self):
+        import numpy as np
+
+        n = len(self)
+        if not self.spills(n):
+            return np.arange(n, dtype=np.int64)
+        path = self.spill_file()
+        with open(path, "ab") as f:
+            for lo, hi in self.chunks(n):
+                np.arange(lo, hi, dtype=np.int64).tofile(f)
+        return self.map_spill(path)
+
+    def density(self, positions):
+        """
+        Density around each position, looked up from a histogram of all points
+        that is computed once and shared by every level of the tree.
+
+        Uses the units of the kNN proxy it replaces, 1 / (pi * r_k^2) ~= rho / k,
+        so QuadTree.BETA and QuadTree.ALPHA keep their meaning.
+        """
+        import numpy as np
+
+        if self.density_grid is None:
+            counts = np.zeros(self.DENSITY_GRID**2, dtype=np.int64)
+            step = self.spill_rows or self.DENSITY_CHUNK_ROWS
+            for lo in range(0, len(self), step):
+                counts += np.bincount(
+                    self._cells(slice(lo, lo + step)), minlength=self.DENSITY_GRID**2
+                )
+            counts = counts.reshape(self.DENSITY_GRID, self.DENSITY_GRID)
+
+            # 3x3 box blur so sparse regions don't collapse to single-point cells
+            padded = np.pad(counts.astype(np.float32), 1)
+            blurred = sum(
+                padded[i : i + self.DENSITY_GRID, j : j + self.DENSITY_GRID]
+                for i in range(3)
+                for j in range(3)
+            )
+            cell_area = (self.EXTENT / self.DENSITY_GRID) ** 2
+            self.density_grid = blurred / (9 * cell_area * self.DENSITY_K)
+
+        return self.density_grid.ravel()[self._cells(positions)]
+
+    def nearest(self, queries, positions, exclude=None):
+        """
+        For every query point, the index into positions of its nearest neighbour
+        among positions (leaving out those where exclude is set), or -1 if none
+        was found.
+
+        Every node queries the same KD-tree, built once over the indexed points,
+        and keeps the closest neighbour that belongs to the node. Queries whose
+        MAX_SNAP_NEIGHBORS nearest points all lie outside the node (usually
+        regions already emptied by ancestors) are left to the caller's fill.
+        """
+        import numpy as np
+        from scipy.spatial import cKDTree
+
+        if self.spills(len(positions)):
+            return self._nearest_chunked(queries, positions, exclude)
+
+        if self._index is None:
+            indexed = self.index_positions
+            if indexed is None:
+                indexed = np.arange(len(self), dtype=np.int64)
+            self._index = cKDTree(self.coords(indexed), leafsize=40)
+            self._slots = np.full(len(indexed), -1, dtype=np.int64)
+
+        if self.index_positions is None:
+            index_slots = positions
+        else:
+            index_slots = np.searchsorted(self.index_positions, positions)
+        self._slots[index_slots] = np.arange(len(positions))
+        if exclude is not None:
+            self._slots[index_slots[exclude]] = -1
+
+        result = np.full(len(queries), -1, dtype=np.int64)
+        todo = np.arange(len(queries))
+        k = self.SNAP_NEIGHBORS
+        while len(todo):
+            k = min(k, len(self._slots))
+            _, neighbours = self._index.query(queries[todo], k=k, workers=-1)
+            neighbours = neighbours.reshape(len(todo), -1)
+            local = self._slots[neighbours]  # (m, k), -1 outside the node
+            inside = local >= 0
+            found = inside.any(axis=1)
+            first = inside.argmax(axis=1)  # neighbours come sorted by distance
+            result[todo[found]] = local[found, first[found]]
+            todo = todo[~found]
+            if k >= min(self.MAX_SNAP_NEIGHBORS, len(self._slots)):
+                break
+            k *= 8
+
+        self._slots[index_slots] = -1
+        return result
+
+    def _nearest_chunked(self, queries, positions, exclude=None):
+        """
+        nearest for a node too big for memory: a KD-tree per chunk of its
+        positions, keeping each query's closest hit across the chunks.
+        """
+        import numpy as np
+        from scipy.spatial import cKDTree
+
+        result = np.full(len(queries), -1, dtype=np.int64)
+        best = np.full(len(queries), np.inf)
+        for lo, hi in self.chunks(len(positions)):
+            local = np.arange(lo, hi)
+            if exclude is not None:
+                local = local[~exclude[lo:hi]]
+            if not len(local):
+                continue
+            tree = cKDTree(self.coords(positions[local]), leafsize=40)
+            dist, found = tree.query(queries, k=1, workers=-1)
+            closer = dist < best
+            best[closer] = dist[closer]
+            result[closer] = local[found[closer]]
+        return result
+
+    def _cells(self, positions):
+        import numpy as np
+
+        scale = self.DENSITY_GRID / self.EXTENT
+        last = self.DENSITY_GRID - 1
+        gx = np.clip((self.x[positions] * scale).astype(np.int64), 0, last)
+        gy = np.clip((self.y[positions] * scale).astype(np.int64), 0, last)
+        return gx * self.DENSITY_GRID + gy
+
+    def coords(self, positions):
+        import numpy as np
+
+        return np.column_stack(
+            [self.x[positions].astype(np.float64), self.y[positions].astype(np.float64)]
+        )
+
+
 class QuadTree:
-    """Splits (x, y, idx) items into quadtree tiles."""
+    """Splits points into quadtree tiles; nodes hold positions into PointColumns."""
 
     # note: this is an impperfect system: if certain parts of the map are 
     # extremely more dense than others, edge artifacts may show
@@ -14,84 +241,181 @@ class QuadTree:
     SPATIAL_FRACTION = 0.85
 
     def __init__(
-        self, center_x, center_y, size, items, depth=0
-    ):  # items are a list of (x, y, idx)
-        self.nodes = []
+        self, center_x, center_y, size, points, positions=None, depth=0
+    ):  # positions index into points, defaulting to all of them
+        import numpy as np
+
+        self.nodes = np.empty(0, dtype=np.int64)
         self.children = []
         self.center = [center_x, center_y]
         self.size = size  # distance from center to edge
         self.depth = depth
+        self.points = points
+        self.rng = np.random  # MortonQuadTree seeds one per tile
+
+        if positions is None:
+            positions = points.all_positions()
+        self.build(positions)
+
+    def __getstate__(self):
+        # subtrees come back from pool workers without the shared columns
+        state = self.__dict__.copy()
+        for name in ("points", "codes", "rng", "_subtree"):
+            state.pop(name, None)
+        return state
+
+    def deferred(self, n):
+        """Whether a subtree of n points at this depth goes to the process pool."""
+        points = self.points
+        return (
+            points.pool is not None
+            and self.depth == points.pool_depth
+            and n > self.MAX_TILE_POINTS
+        )
+
+    def defer(self, positions):
+        """Hand this subtree to the process pool if it sits at the pool depth."""
+        points = self.points
+        if not self.deferred(len(positions)):
+            return False
+
+        self._subtree = points.pool.submit(
+            build_subtree,
+            type(self),
+            points.path,
+            points.density_grid,
+            self.center,
+            self.size,
+            self.depth,
+            positions,
+        )
+        return True
+
+    def collect(self):
+        """Swap finished subtrees from the process pool into the tree."""
+        subtree = getattr(self, "_subtree", None)
+        if subtree is not None:
+            built = subtree.result()
+            self.nodes, self.children = built.nodes, built.children
+            self._subtree = None
 
-        self.build(items)
+        for child in self.children:
+            child.points = self.points
+            child.collect()
 
-    def build(self, items):
-        if len(items) <= self.MAX_TILE_POINTS:
-            self.nodes = items
+    def build(self, positions):
+        import numpy as np
+
+        if self.defer(positions):
+            return
+
+        if len(positions) <= self.MAX_TILE_POINTS:
+            # xy.arrow is in table order, so leaves shuffle their own points
+            self.nodes = self.rng.permutation(np.asarray(positions))
             self.children = []
             return
 
-        synthetic_sample = self.get_synthetic_sample(items)
-        real_sample = self.snap_to_real(synthetic_sample, items)
-        self.nodes = real_sample
+        synthetic_sample = self.get_synthetic_sample(positions)
+        picked = self.snap_to_real(synthetic_sample, positions)
+        self.nodes = positions[picked]
+        self.split(self.get_quad_lists(positions, picked))
+
+    def get_quad_lists(self, positions, picked=None):
+        """
+        Split positions (leaving out the indices in picked) into the four
+        quadrants. Out of core, partitions too big for memory are streamed a
+        chunk at a time into memory-mapped spill files.
+        """
+        import numpy as np
+
+        points = self.points
+        if not points.spills(len(positions)):
+            if picked is not None:
+                keep = np.ones(len(positions), dtype=bool)
+                keep[picked] = False
+                positions = positions[keep]
+            return [positions[mask] for mask in self.quadrant_masks(positions)]
 
-        sampled_idxs = {pt[2] for pt in real_sample}
-        remaining_items = [pt for pt in items if pt[2] not in sampled_idxs]
-        quad_list = self.get_quad_lists(remaining_items)
-        self.split(quad_list)
+        picked = np.sort(picked) if picked is not None else np.empty(0, dtype=np.int64)
+        paths = [points.spill_file() for _ in range(4)]
+        files = [open(path, "ab") for path in paths]
+        try:
+            for lo, hi in points.chunks(len(positions)):
+                chunk = np.asarray(positions[lo:hi])
+                first, last = np.searchsorted(picked, [lo, hi])
+                keep = np.ones(hi - lo, dtype=bool)
+                keep[picked[first:last] - lo] = False
+                chunk = chunk[keep]
+                for f, mask in zip(files, self.quadrant_masks(chunk)):
+                    chunk[mask].tofile(f)
+        finally:
+            for f in files:
+                f.close()
+        return [points.map_spill(path) for path in paths]
+
+    def quadrant_masks(self, positions):
+        import numpy as np
 
-    def get_quad_lists(self, items):
         #    0  |  2
         #    -------
         #    1  |  3
-        quad_list = [[], [], [], []]
-        for item in items:
-            if item[0] <= self.center[0]:
-                if item[1] <= self.center[1]:
-                    quad_list[0].append(item)
-                else:
-                    quad_list[1].append(item)
-            else:
-                if item[1] <= self.center[1]:
-                    quad_list[2].append(item)
-                else:
-                    quad_list[3].append(item)
-        return quad_list
-
-    def get_synthetic_sample(self, items):
-        import numpy as np
-        from sklearn.neighbors import NearestNeighbors
-
-        # build coords array
-        coords = np.stack([[x, y] for x, y, _ in items])  # (n,2)
-        n = len(coords)
+        left = self.points.x[positions] <= np.float64(self.center[0])
+        top = self.points.y[positions] <= np.float64(self.center[1])
+        return [left & top, left & ~top, ~left & top, ~left & ~top]
+
+    def node_columns(self):
+        """(x, y, row_index) arrays for the points stored in this node."""
+        return (
+            self.points.x[self.nodes],
+            self.points.y[self.nodes],
+            self.points.row_index[self.nodes],
+        )
+
+    def get_synthetic_sample(self, positions, taken=None):
+        import numpy as np
+
+        points = self.points
+        n = len(positions)
         M = self.MAX_TILE_POINTS
 
         # how many we uniform vs adaptive density sample
         M_uni = int(self.SPATIAL_FRACTION * M)  # uniform-spatial
         M_adapt = M - M_uni  # density-adaptive
 
-        # density proxy via k-NN
-        k = 8
-        nbrs = NearestNeighbors(n_neighbors=k).fit(coords)
-        dists, _ = nbrs.kneighbors(coords)
-        r_k = dists[:, -1]
-        dens = 1.0 / (np.pi * r_k**2 + 1e-12)
-
-        #  build adaptive weights
-        w = (1 - self.BETA) + self.BETA * (1.0 / (dens**self.ALPHA))
-        w /= w.sum()
+        # adaptive picks (actual data points) weighted from the shared density
+        # grid, plus the bounding box; a chunk at a time so out of core builds
+        # never hold a weight per point. Sampling without replacement keeps the
+        # M_adapt largest keys log(u) / w (Efraimidis-Spirakis), which can be
+        # drawn chunk by chunk
+        keys = np.empty(0)
+        idx_adapt = np.empty(0, dtype=np.int64)
+        x0 = y0 = np.inf
+        x1 = y1 = -np.inf
+        for lo, hi in points.chunks(n):
+            chunk = positions[lo:hi]
+            dens = points.density(chunk).astype(np.float64) + 1e-12
+            w = (1 - self.BETA) + self.BETA * (1.0 / (dens**self.ALPHA))
+            if taken is not None:  # already sampled by an ancestor
+                w[taken[lo:hi]] = 0
+            with np.errstate(divide="ignore"):
+                keys = np.concatenate([keys, np.log(self.rng.random(hi - lo)) / w])
+            idx_adapt = np.concatenate([idx_adapt, np.arange(lo, hi)])
+            if len(keys) > M_adapt:
+                top = np.argpartition(keys, -M_adapt)[-M_adapt:]
+                keys, idx_adapt = keys[top], idx_adapt[top]
+            xs, ys = points.x[chunk], points.y[chunk]
+            x0, x1 = min(x0, xs.min()), max(x1, xs.max())
+            y0, y1 = min(y0, ys.min()), max(y1, ys.max())
+        x0, y0, x1, y1 = (np.float64(v) for v in (x0, y0, x1, y1))
 
-        # adaptive picks (actual data points)
-        idx_adapt = np.random.choice(n, size=M_adapt, replace=False, p=w)
-        pts_adapt = coords[idx_adapt]
+        idx_adapt = self.rng.permutation(idx_adapt)
+        pts_adapt = points.coords(positions[idx_adapt])
 
         # uniform-spatial picks (synthetic coords)
-        x0, y0 = coords[:, 0].min(), coords[:, 1].min()
-        x1, y1 = coords[:, 0].max(), coords[:, 1].max()
         pts_uni = np.column_stack(
             [
-                np.random.uniform(x0, x1, size=M_uni),
-                np.random.uniform(y0, y1, size=M_uni),
+                self.rng.uniform(x0, x1, size=M_uni),
+                self.rng.uniform(y0, y1, size=M_uni),
             ]
         )
 
@@ -99,84 +423,88 @@ class QuadTree:
 
         return synthetic
 
-    def snap_to_real(self, synthetic, items):
-        from sklearn.neighbors import KDTree
+    def snap_to_real(self, synthetic, positions, taken=None):
         import numpy as np
-        import random
 
         """
         synthetic : np.ndarray of shape (M,2)  — “ideal” floats
-        items     : list of (x, y, idx)        — the full real dataset at this node
+        positions : np.ndarray of point positions — the full real dataset at this node
+        taken     : optional mask of positions an ancestor already sampled
 
-        Returns a list of (x, y, idx) real points, one per synthetic sample (deduped).
+        Returns indices into positions, one per synthetic sample (deduped).
         """
-        # Extract coords into an (n,2) array
-        coords = np.array([[x, y] for x, y, _ in items])
-        # Build the KD-tree on those coords
-        tree = KDTree(coords, leaf_size=40)
-
-        #  Query each synthetic point’s nearest neighbor
-        #  dists: (M,1), idxs: (M,1) into the coords/items array
-        dists, idxs = tree.query(synthetic, k=1)
-        idxs = idxs.ravel()  # shape (M,)
+        #  nearest real point of this node for each synthetic point
+        idxs = self.points.nearest(synthetic, positions, exclude=taken)
+        idxs = idxs[idxs >= 0]
 
         # Deduplicate while preserving order
-        seen = set()
-        real_sample = []
-        for i in idxs:
-            if i not in seen:
-                seen.add(i)
-                real_sample.append(items[i])
-
-        # If we’re short, fill up with random unused points (shouldn't happen)
+        _, first = np.unique(idxs, return_index=True)
+        real_sample = idxs[np.sort(first)]
+
+        # If we’re short, fill up with random unused points
         if len(real_sample) < self.MAX_TILE_POINTS:
-            all_indices = set(range(len(items)))
-            unused = list(all_indices - seen)
+            used = real_sample
+            if taken is not None:
+                used = np.concatenate([used, np.flatnonzero(taken)])
             need = self.MAX_TILE_POINTS - len(real_sample)
-
-            if len(unused) <= need:
-                fill_idxs = unused
-            else:
-                fill_idxs = random.sample(unused, need)
-
-            for i in fill_idxs:
-                real_sample.append(items[i])
+            fill_idxs = self.unused_sample(len(positions), used, need)
+            real_sample = np.concatenate([real_sample, fill_idxs])
         print("got real sample")
 
         return real_sample
 
+    def unused_sample(self, n, used, k):
+        """
+        Up to k distinct random indices in range(n) that aren't in used, without
+        a mask over all n (an out of core node has more rows than fit in memory).
+        """
+        import numpy as np
+
+        used = np.unique(used)
+        free = n - len(used)
+        if free <= k:
+            return np.setdiff1d(np.arange(n), used, assume_unique=True)
+
+        ranks = np.unique(self.rng.choice(free, k))
+        while len(ranks) < k:
+            ranks = np.union1d(ranks, self.rng.choice(free, k - len(ranks)))
+        # the r-th unused index is r plus the used indices with at most r unused below
+        below = used - np.arange(len(used))
+        return self.rng.permutation(ranks + np.searchsorted(below, ranks, side="right"))
+
     def split(self, quad_lists):
         self.children = [
-            QuadTree(
+            self.make_child(
                 self.center[0] - self.size / 2,
                 self.center[1] - self.size / 2,
-                self.size / 2,
                 quad_lists[0],
-                self.depth + 1,
             ),
-            QuadTree(
+            self.make_child(
                 self.center[0] - self.size / 2,
                 self.center[1] + self.size / 2,
-                self.size / 2,
                 quad_lists[1],
-                self.depth + 1,
             ),
-            QuadTree(
+            self.make_child(
                 self.center[0] + self.size / 2,
                 self.center[1] - self.size / 2,
-                self.size / 2,
                 quad_lists[2],
-                self.depth + 1,
             ),
-            QuadTree(
+            self.make_child(
                 self.center[0] + self.size / 2,
                 self.center[1] + self.size / 2,
-                self.size / 2,
                 quad_lists[3],
-                self.depth + 1,
             ),
         ]
 
+    def make_child(self, center_x, center_y, positions):
+        points = self.points.for_subtree(positions)
+        child = QuadTree(
+            center_x, center_y, self.size / 2, points, positions, self.depth + 1
+        )
+        if points is not self.points:
+            points.release()
+        return child
+
     def print_tree(self, indent=0):
         spacing = " " * indent
         print(
@@ -186,3 +514,197 @@ class QuadTree:
         for i, child in enumerate(self.children):
             print(f"{spacing} Child {i}:")
             child.print_tree(indent + 4)
+
+
+class MortonCodes:
+    """
+    Z-order codes of a set of points, sorted once and shared by every node of a
+    MortonQuadTree.
+
+    Because the extent is fixed at 100x100, the points of the tile z/x_y are
+    exactly the codes starting with the 2z-bit prefix interleave(x, y).
+    """
+
+    LEVELS = 31  # bits per axis; finer than float32 resolution across the extent
+    EXTENT = 100.0
+
+    def __init__(self, points, positions, seed=None):
+        import numpy as np
+
+        codes = (self.cells(points.x[positions]) << 1) | self.cells(points.y[positions])
+        sort = np.argsort(codes)  # ties share a cell finer than float32, any order
+        self.codes = codes[sort]
+        self.order = positions[sort]
+        self.taken = np.zeros(len(positions), dtype=bool)  # sampled by an ancestor
+        # drawn from the global state, so np.random.seed still pins the tiles
+        self.seed = np.random.randint(2**32) if seed is None else seed
+
+    @classmethod
+    def cells(cls, values):
+        """Spread grid cells, chosen so x <= center matches the QuadTree split."""
+        import numpy as np
+
+        scaled = values.astype(np.float64) * 2.0**cls.LEVELS / cls.EXTENT
+        cells = np.clip(np.ceil(scaled) - 1, 0, 2**cls.LEVELS - 1)
+        return spread_bits(cells.astype(np.uint64))
+
+    def span(self, depth, tile_x, tile_y):
+        """(lo, hi) such that the tile's points are order[lo:hi]."""
+        import numpy as np
+
+        shift = 2 * (self.LEVELS - depth)
+        prefix = (int(spread_bits(tile_x)) << 1) | int(spread_bits(tile_y))
+        lo, hi = np.searchsorted(
+            self.codes,
+            np.array([prefix << shift, (prefix + 1) << shift], dtype=np.uint64),
+        )
+        return int(lo), int(hi)
+
+
+def spread_bits(v):
+    """Interleave zeros between the low 32 bits of v."""
+    import numpy as np
+
+    v = np.asarray(v, dtype=np.uint64)
+    for shift, mask in (
+        (16, 0x0000FFFF0000FFFF),
+        (8, 0x00FF00FF00FF00FF),
+        (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333),
+        (1, 0x5555555555555555),
+    ):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+class MortonQuadTree(QuadTree):
+    """
+    QuadTree built from a single sort of the points' Z-order codes.
+
+    Each node finds its points as a contiguous slice of the sorted codes by
+    binary search on its tile prefix and samples straight from that view, with
+    points taken by ancestors masked out, so no per-level partition lists are
+    copied. Every tile draws from its own generator seeded by its coordinates.
+    """
+
+    def __init__(
+        self, center_x, center_y, size, points, positions=None, depth=0, codes=None
+    ):
+        import numpy as np
+
+        if codes is None:
+            if positions is None:
+                positions = np.arange(len(points), dtype=np.int64)
+            codes = MortonCodes(points, positions)
+        self.codes = codes
+
+        super().__init__(center_x, center_y, size, points, codes.order, depth)
+
+    def build(self, positions):  # the node's points come from its code prefix instead
+        import numpy as np
+
+        codes = self.codes
+        tile_x = round((self.center[0] - self.size) / (2 * self.size))
+        tile_y = round((self.center[1] - self.size) / (2 * self.size))
+        self.rng = np.random.default_rng([codes.seed, self.depth, tile_x, tile_y])
+
+        lo, hi = codes.span(self.depth, tile_x, tile_y)
+        candidates, taken = codes.order[lo:hi], codes.taken[lo:hi]  # views
+        n_free = len(candidates) - np.count_nonzero(taken)
+
+        if self.deferred(n_free):
+            self.defer(candidates[~taken])
+            return
+
+        if n_free <= self.MAX_TILE_POINTS or self.depth >= MortonCodes.LEVELS:
+            self.nodes = self.rng.permutation(candidates[~taken])
+            self.children = []
+            return
+
+        synthetic_sample = self.get_synthetic_sample(candidates, taken)
+        picked = self.snap_to_real(synthetic_sample, candidates, taken)
+        self.nodes = candidates[picked]
+        taken[picked] = True
+        self.split([None] * 4)
+
+    def make_child(self, center_x, center_y, positions):
+        return MortonQuadTree(
+            center_x,
+            center_y,
+            self.size / 2,
+            self.points,
+            depth=self.depth + 1,
+            codes=self.codes,
+        )
+
+
+def build_quadtree(
+    xy_path, tree_cls=None, workers=1, pool_depth=2, memory_budget=None, spill_dir=None
+):
+    """
+    Build the tile quadtree over xy.arrow (normalized to 100x100).
+
+    With workers > 1 every subtree rooted at pool_depth is built in its own
+    process. Workers memory-map xy.arrow themselves and only receive the
+    subtree's positions and the density grid, never the point data.
+
+    With a memory_budget (bytes) the build runs out of core instead: partitions
+    longer than the budget allows are streamed into memory-mapped files under
+    spill_dir and subtrees are built one at a time, in this process.
+    """
+    import multiprocessing as mp
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+
+    tree_cls = tree_cls or QuadTree
+    points = PointColumns.from_arrow(xy_path)
+
+    if memory_budget is not None:
+        return _build_out_of_core(tree_cls, points, memory_budget, spill_dir)
+
+    if workers <= 1:
+        return tree_cls(50, 50, 50, points)
+
+    ctx = mp.get_context("spawn")  # keep the parent's memory out of the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        points.density(np.empty(0, dtype=np.int64))  # one grid for every worker
+        points.pool, points.pool_depth = pool, pool_depth
+        tree = tree_cls(50, 50, 50, points)
+        points.pool = None
+        tree.collect()
+
+    return tree
+
+
+# rough bytes held per row of an in-memory partition while a node is split:
+# positions, gathered x/y, quadrant masks, density cells, sampling keys and
+# the subtree's KD-tree (coordinates, its own copy of them, indices, slots)
+SPILL_ROW_BYTES = 128
+
+
+def _build_out_of_core(tree_cls, points, memory_budget, spill_dir):
+    import os, shutil
+
+    if issubclass(tree_cls, MortonQuadTree):
+        # the morton codes are one global sort; the partition splitter can
+        # spill level by level
+        print("out of core build: using the partition splitter")
+        tree_cls = QuadTree
+
+    points.spill_dir = spill_dir
+    points.spill_rows = max(QuadTree.MAX_TILE_POINTS, memory_budget // SPILL_ROW_BYTES)
+    os.makedirs(spill_dir, exist_ok=True)
+    try:
+        return tree_cls(50, 50, 50, points)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def build_subtree(tree_cls, xy_path, density_grid, center, size, depth, positions):
+    """Pool worker entry point: build one subtree over a memory-mapped xy.arrow."""
+    import numpy as np
+
+    points = PointColumns.from_arrow(
+        xy_path, density_grid=density_grid, index_positions=np.sort(positions)
+    )
+    return tree_cls(center[0], center[1], size, points, positions, depth)
@@ -5,11 +5,37 @@ app = modal.App("create_projection")
 MOUNT = "/cache"
 vol = modal.Volume.from_name("reduction-files", create_if_missing=True)
 
+# tables up to this many rows are reduced on CPU rather than queueing for a GPU
+CPU_REDUCE_MAX_ROWS = 200_000
+# above LANDMARK_MIN_ROWS the reducer is fitted on LANDMARK_ROWS sampled rows
+# and the rest are projected through the fitted model
+LANDMARK_MIN_ROWS = 10_000_000
+LANDMARK_ROWS = 2_000_000
+
+# shards, kNN graphs and fitted reducers, one directory per table snapshot
+ARTIFACTS = f"{MOUNT}/artifacts"
+ARTIFACT_TTL = 7 * 24 * 60 * 60  # seconds since last use
+ARTIFACT_MAX_BYTES = 500 * 1024**3
+# kept from eviction this long by each stage that reads an entry: as long as
+# the longest of them (upload_tiles) can run, or the embed can queue for a GPU
+ARTIFACT_LEASE = 7 * 60 * 60
+
+# per projection: watermark, fitted reducers and tile order for refresh_projection
+REFRESH = f"{MOUNT}/refresh"
+
+# shards each fetch_shards container streams at once, one pooled connection each
+FETCH_CONNECTIONS_PER_CONTAINER = 4
+
+# cores reserved for upload_tiles, which sizes its quadtree and encoding pools
+# from them; tables below POOL_MIN_ROWS are tiled in-process
+UPLOAD_TILES_CPU = 8
+POOL_MIN_ROWS = 1_000_000
+
 
 @app.function(
     image=modal.Image.debian_slim()
     .pip_install("psycopg[binary]", "supabase", "pyarrow")
-    .add_local_python_source("utils"),
+    .add_local_python_source("utils", "reducers"),
     secrets=[modal.Secret.from_name("supabase-credentials")],
     volumes={MOUNT: vol},
     timeout=7 * 60 * 60, #6 hours
@@ -23,9 +49,34 @@ def orchestrator(
     database_id: str,
     total_rows: str,
     remaining_rows: str,
+    reducer: str | None = None,  # see reducers.REDUCERS; picked by table size if None
+    refresh_col: str | None = None,  # "xmin" or e.g. updated_at, to allow refreshes
+    columns: str | None = None,  # "a,b,c" to fetch only these (besides key and vector)
+    truncate: str | None = None,  # "a:500,b:200" to cut long text server-side
+    halfvec: bool = False,  # fetch and store vectors as float16
+    pre_reduce: str | None = None,  # "pca" or "random" to shrink vectors first
+    pre_reduce_dim: int = 64,
 ):
-    from utils import get_num_shards, get_creds, failed as fail_update, check_and_update_usage
-    import os
+    from utils import (
+        parse_column_selection,
+        plan_fetch,
+        plan_shards,
+        get_creds,
+        failed as fail_update,
+        check_and_update_usage,
+        artifact_key,
+        read_manifest,
+        write_manifest,
+        lease_artifacts,
+        publish_shards,
+        current_watermark,
+        update_refresh_state,
+        AdaptiveFetcher,
+        SharedSnapshot,
+        split_connections,
+    )
+    from reducers import check_reducer
+    import os, shutil, time
     from supabase import create_client
 
     run_dir = f"{MOUNT}/{projection_id}"
@@ -39,42 +90,166 @@ def orchestrator(
     try:
         total_rows_estimate_int = int(total_rows)
         creds = get_creds(database_id)
-        NUM_SHARDS = get_num_shards(total_rows_estimate_int, creds)
-        print(f"NUM_SHARDS: {NUM_SHARDS}")
-
-        const_kw = dict(
-            schema=schema,
-            table=table,
-            vector_col=vector_col,
-            primary_key_col=primary_key_col,
-            total_shards=NUM_SHARDS,
-            creds=creds,
-            run_dir=run_dir,
+        columns, truncate = parse_column_selection(columns, truncate)
+        if pre_reduce not in (None, "pca", "random"):
+            raise ValueError(f"unknown pre-reduction {pre_reduce}")
+        if reducer is not None:
+            check_reducer(reducer)
+
+        # an unchanged table reuses the shards (and reductions) of earlier runs;
+        # a fetch goes into the run's own directory and is published to the
+        # cache once complete. Tables that can't be fingerprinted keep their
+        # shards with the run
+        cache_key = artifact_key(
+            creds,
+            schema,
+            table,
+            vector_col,
+            primary_key_col,
+            columns,
+            truncate,
+            halfvec,
         )
-        shard_ids = list(range(NUM_SHARDS))
-        wave_size = NUM_SHARDS
-        while shard_ids:
-            failed, ok = run_wave(shard_ids, wave_size, const_kw)
-            if not failed:
-                print(f"✅  All {ok} shards completed successfully")
-                break
-
-            prev = wave_size
-            wave_size = max(1, int(wave_size // 1.5))
-            shard_ids = failed
-            print(
-                f"↩︎  {ok} shards ok, {len(failed)} hit pool limit; "
-                f"retrying with wave_size={wave_size} (was {prev})"
+        artifact_dir = f"{ARTIFACTS}/{cache_key}" if cache_key else None
+        manifest = artifact_dir and read_manifest(artifact_dir)
+        shard_dir = f"{artifact_dir if manifest else run_dir}/shards"
+
+        state_dir = None
+        if refresh_col:
+            state_dir = f"{REFRESH}/{projection_id}"
+            shutil.rmtree(state_dir, ignore_errors=True)
+            update_refresh_state(
+                state_dir,
+                schema=schema,
+                table=table,
+                vector_col=vector_col,
+                primary_key_col=primary_key_col,
+                database_id=database_id,
+                refresh_col=refresh_col,
+                columns=columns,
+                truncate=truncate,
+                halfvec=halfvec,
+                # before the fetch: later changes are the next refresh's job
+                watermark=current_watermark(creds, schema, table, refresh_col),
             )
 
+        if manifest:
+            NUM_SHARDS = manifest["num_shards"]
+            print(f"reusing {NUM_SHARDS} cached shards from {artifact_dir}")
+        else:
+            shutil.rmtree(shard_dir, ignore_errors=True)  # left by a failed fetch
+            fetch_plan = plan_fetch(
+                creds,
+                schema,
+                table,
+                vector_col,
+                total_rows_estimate_int,
+                columns=columns,
+                truncate=truncate,
+                halfvec=halfvec,
+                primary_key_col=primary_key_col,
+            )
+            NUM_SHARDS = fetch_plan["num_shards"]
+            # every shard reads the table as of one moment while this is open
+            with SharedSnapshot(creds) as snapshot:
+                shard_plan = plan_shards(
+                    creds,
+                    schema,
+                    table,
+                    primary_key_col,
+                    NUM_SHARDS,
+                    allow_ctid=snapshot.id is not None,
+                )
+                NUM_SHARDS = len(shard_plan)
+                print(f"NUM_SHARDS: {NUM_SHARDS}")
+
+                const_kw = dict(
+                    schema=schema,
+                    table=table,
+                    vector_col=vector_col,
+                    primary_key_col=primary_key_col,
+                    shard_plan=shard_plan,
+                    creds=creds,
+                    shard_dir=shard_dir,
+                    columns=columns,
+                    truncate=truncate,
+                    halfvec=halfvec,
+                    snapshot=snapshot.id,
+                )
+                containers, per_container = split_connections(
+                    min(NUM_SHARDS, fetch_plan["concurrency"]),
+                    FETCH_CONNECTIONS_PER_CONTAINER,
+                )
+                batches = [
+                    list(range(lo, min(lo + per_container, NUM_SHARDS)))
+                    for lo in range(0, NUM_SHARDS, per_container)
+                ]
+                AdaptiveFetcher(
+                    lambda shard_ids: fetch_shards.remote(
+                        shard_ids, connections=per_container, **const_kw
+                    ),
+                    max_concurrency=containers,
+                ).run(batches)
+
         remaining_rows_int = int(remaining_rows)
         check_and_update_usage(
-            NUM_SHARDS, run_dir, remaining_rows_int, database_id, total_rows_estimate_int, supabase_client, vol
+            NUM_SHARDS, shard_dir, remaining_rows_int, database_id, total_rows_estimate_int, supabase_client, vol
         )  # will error if usage exceeded
 
-        embed_to_2d.spawn(
-            primary_key_col, vector_col, run_dir, projection_id, NUM_SHARDS
-        )
+        if artifact_dir and not manifest:
+            fetched_dir = shard_dir
+            shard_dir = publish_shards(fetched_dir, artifact_dir)
+            if shard_dir != fetched_dir:
+                # written once the shards are in place, so it marks the entry usable
+                manifest = write_manifest(
+                    artifact_dir,
+                    {
+                        "num_shards": NUM_SHARDS,
+                        "shard_plan": shard_plan,
+                        "created": time.time(),
+                    },
+                )
+        if manifest:
+            lease_artifacts(artifact_dir, ARTIFACT_LEASE)
+        vol.commit()
+
+        if reducer is None:
+            reducer = "umap" if total_rows_estimate_int <= CPU_REDUCE_MAX_ROWS else "cuml"
+        landmark_rows = None
+        if total_rows_estimate_int > LANDMARK_MIN_ROWS:
+            landmark_rows = LANDMARK_ROWS
+        if state_dir:
+            update_refresh_state(state_dir, reducer=reducer)
+            vol.commit()
+        if reducer == "cuml":
+            embed_to_2d.spawn(
+                primary_key_col,
+                vector_col,
+                run_dir,
+                projection_id,
+                NUM_SHARDS,
+                pre_reduce=pre_reduce,
+                pre_reduce_dim=pre_reduce_dim,
+                landmark_rows=landmark_rows,
+                shard_dir=shard_dir,
+                artifact_dir=artifact_dir,
+                state_dir=state_dir,
+            )
+        else:
+            embed_to_2d_cpu.spawn(
+                primary_key_col,
+                vector_col,
+                run_dir,
+                projection_id,
+                NUM_SHARDS,
+                reducer=reducer,
+                pre_reduce=pre_reduce,
+                pre_reduce_dim=pre_reduce_dim,
+                landmark_rows=landmark_rows,
+                shard_dir=shard_dir,
+                artifact_dir=artifact_dir,
+                state_dir=state_dir,
+            )
     except Exception:
         fail_update(supabase_client, projection_id)
         cleanup_volume.spawn(projection_id)
@@ -82,36 +257,45 @@ def orchestrator(
 
 @app.function(
     image=modal.Image.debian_slim()
-    .pip_install("psycopg[binary]", "pyarrow", "pgvector", "supabase")
-    .add_local_python_source("utils"),
+    .pip_install("psycopg[binary,pool]", "pyarrow", "numpy", "pgvector", "supabase")
+    .add_local_python_source("utils", "copy_decoder"),
     volumes={MOUNT: vol},
     timeout=7 * 60 * 60,  # 6 hours
 )
-def fetch_table(
-    shard_id: int,
+def fetch_shards(
+    shard_ids: list[int],
     *,
     schema: str,
     table: str,
     vector_col: str,
     primary_key_col: str,
-    total_shards: int,
+    shard_plan: list[tuple[str, list]],
     creds,
-    run_dir: str,
+    shard_dir: str,
+    connections: int = FETCH_CONNECTIONS_PER_CONTAINER,
+    columns: list[str] | None = None,
+    truncate: dict[str, int] | None = None,
+    halfvec: bool = False,
+    snapshot: str | None = None,
 ):
-    """Write postgres table shard to /cache/<shard>.arrow"""
-    from utils import fetch_table_helper
-    import os
+    """Write postgres table shards to <shard_dir>/<shard>.arrow, `connections` at a time"""
+    from utils import fetch_shards_helper
 
     vol.reload()  # needed if this container was not triggered by this invocation of the function
-    fetch_table_helper(
-        shard_id,
+    return fetch_shards_helper(
+        shard_ids,
         schema,
         table,
         vector_col,
         primary_key_col,
-        total_shards,
+        shard_plan,
         creds,
-        run_dir,
+        shard_dir,
+        connections=connections,
+        columns=columns,
+        truncate=truncate,
+        halfvec=halfvec,
+        snapshot=snapshot,
     )
 
 
@@ -122,7 +306,7 @@ def fetch_table(
     .pip_install("numpy")
     .pip_install("supabase")
     .pip_install("pyarrow")
-    .add_local_python_source("utils"),
+    .add_local_python_source("utils", "reducers"),
     secrets=[modal.Secret.from_name("supabase-credentials")],
     gpu="T4",
     timeout=4 * 60 * 60,
@@ -137,11 +321,88 @@ def embed_to_2d(
     target_gpu_mem: float = 7e9,  # determines how the maximum GPU memory in each batch of UMAP
     n_neighbors: int = 15,
     batch_rows: int = 100_000,
+    pre_reduce: str | None = None,  # "pca" or "random", before UMAP
+    pre_reduce_dim: int = 64,
+    landmark_rows: int | None = None,  # fit on a sample this big, transform the rest
+    shard_dir: str | None = None,  # defaults to run_dir
+    artifact_dir: str | None = None,  # cache entry for the embedding and reducer
+    state_dir: str | None = None,  # set when the projection can be refreshed
 ):
     """
     Write primary_key, x, y to /cache/xy.arrow
     """
-    from utils import embed_to_2d_helper, failed
+    reduce_and_upload(
+        primary_key_col,
+        vector_col,
+        run_dir,
+        projection_id,
+        num_shards,
+        reducer="cuml",
+        target_gpu_mem=target_gpu_mem,
+        n_neighbors=n_neighbors,
+        batch_rows=batch_rows,
+        pre_reduce=pre_reduce,
+        pre_reduce_dim=pre_reduce_dim,
+        landmark_rows=landmark_rows,
+        shard_dir=shard_dir,
+        artifact_dir=artifact_dir,
+        state_dir=state_dir,
+    )
+
+
+@app.function(
+    image=modal.Image.debian_slim()
+    .pip_install("umap-learn", "scikit-learn", "numpy", "supabase", "pyarrow")
+    .add_local_python_source("utils", "reducers"),
+    secrets=[modal.Secret.from_name("supabase-credentials")],
+    cpu=16,
+    memory=32 * 1024,
+    timeout=4 * 60 * 60,
+    volumes={MOUNT: vol},
+)
+def embed_to_2d_cpu(
+    primary_key_col: str,
+    vector_col: str,
+    run_dir: str,
+    projection_id: str,
+    num_shards: int,
+    reducer: str = "umap",  # or "pca" for a quick preview
+    n_neighbors: int = 15,
+    batch_rows: int = 100_000,
+    pre_reduce: str | None = None,
+    pre_reduce_dim: int = 64,
+    landmark_rows: int | None = None,
+    shard_dir: str | None = None,
+    artifact_dir: str | None = None,
+    state_dir: str | None = None,
+):
+    """
+    Same as embed_to_2d without a GPU, for tables small enough that waiting
+    for a T4 takes longer than reducing on CPU cores.
+    """
+    reduce_and_upload(
+        primary_key_col,
+        vector_col,
+        run_dir,
+        projection_id,
+        num_shards,
+        reducer=reducer,
+        n_neighbors=n_neighbors,
+        batch_rows=batch_rows,
+        pre_reduce=pre_reduce,
+        pre_reduce_dim=pre_reduce_dim,
+        landmark_rows=landmark_rows,
+        shard_dir=shard_dir,
+        artifact_dir=artifact_dir,
+        state_dir=state_dir,
+    )
+
+
+def reduce_and_upload(
+    primary_key_col, vector_col, run_dir, projection_id, num_shards, **helper_kwargs
+):
+    """Body of the embed_to_2d functions: reduce to xy.arrow, then start the upload."""
+    from utils import embed_to_2d_helper, failed, lease_artifacts
     from supabase import create_client
     import os
 
@@ -150,17 +411,22 @@ def embed_to_2d(
         os.environ["SUPABASE_KEY"],
     )
     try:
-        embed_to_2d_helper(
-            vector_col,
+        artifact_dir = helper_kwargs.get("artifact_dir")
+        if artifact_dir:
+            vol.reload()
+            lease_artifacts(artifact_dir, ARTIFACT_LEASE)
+            vol.commit()
+        embed_to_2d_helper(vector_col, run_dir, num_shards, vol, **helper_kwargs)
+
+        upload_tiles.spawn(
             run_dir,
-            num_shards,
-            vol,
-            target_gpu_mem,
-            n_neighbors,
-            batch_rows,
+            projection_id,
+            vector_col,
+            primary_key_col,
+            shard_dir=helper_kwargs.get("shard_dir"),
+            state_dir=helper_kwargs.get("state_dir"),
+            artifact_dir=artifact_dir,
         )
-
-        upload_tiles.spawn(run_dir, projection_id, vector_col, primary_key_col)
     except Exception as e:
         print("embed 2d failed", e)
         failed(supabase_client, projection_id)
@@ -172,7 +438,6 @@ def embed_to_2d(
     .pip_install("pyarrow")
     .pip_install("supabase")
     .pip_install("zstandard")
-    .pip_install("tdigest")
     .pip_install("boto3")
     .pip_install("numpy")
     .pip_install("scipy")
@@ -184,78 +449,117 @@ def embed_to_2d(
         modal.Secret.from_name("supabase-credentials"),
         modal.Secret.from_name("cloudflare-credentials"),
     ],
+    cpu=UPLOAD_TILES_CPU,
+    memory=16 * 1024,
     volumes={MOUNT: vol},
     timeout=7 *60 * 60,
 )
 def upload_tiles(
-    run_dir: str, projection_id: str, vector_col: str, primary_key_col: str
+    run_dir: str,
+    projection_id: str,
+    vector_col: str,
+    primary_key_col: str,
+    quadtree_builder: str = "partition",  # or "morton" for the z-order builder
+    quadtree_workers: int | None = None,  # defaults to the container's cores
+    quadtree_pool_depth: int = 2,  # subtrees below this depth go to the pool
+    quadtree_memory_budget: int | None = None,  # bytes; set to build out of core
+    upload_workers: int = 16,  # tiles uploading at once
+    encode_workers: int | None = None,  # tile encoding processes, defaults as above
+    cluster_tiles: bool = False,  # rewrite shards in tile order before encoding
+    shard_dir: str | None = None,  # defaults to run_dir
+    state_dir: str | None = None,  # keep the tile order and tree for refreshes
+    artifact_dir: str | None = None,  # cache entry the shards are read from
 ):
-    from tile_uploader import TileUploader
-    from quadtree import QuadTree
-    import os, pyarrow.ipc as ipc, pyarrow.dataset as ds
+    from tile_uploader import TileUploader, TileEncoder
+    from quadtree import QuadTree, MortonQuadTree, build_quadtree
+    import os, json
+    import pyarrow as pa, pyarrow.ipc as ipc
     from supabase import create_client
     from tile_uploader_utils import (
         make_arrow_schema,
-        get_timestamp_cols,
-        get_digest_by_col,
+        compute_color_stats,
         finalize_projection,
     )
-    from utils import failed
+    from utils import failed, update_refresh_state, lease_artifacts
 
     supabase_client = create_client(
         os.environ["SUPABASE_URL"],
         os.environ["SUPABASE_KEY"],
     )
     try:
-
         print("starting upload tiles")
         vol.reload()
+        if artifact_dir:
+            lease_artifacts(artifact_dir, ARTIFACT_LEASE)
+            vol.commit()
 
         xy_path = os.path.join(run_dir, "xy.arrow")
-        reader = ipc.open_file(xy_path)
-        table = reader.read_all()
-        cols = table.to_pydict()
-
-        items = [
-            (float(x), float(y), int(idx))
-            for x, y, idx in zip(cols["x"], cols["y"], cols["row-index"])
-        ]
+        num_points = ipc.open_file(pa.memory_map(xy_path, "r")).read_all().num_rows
+        # os.cpu_count() is the host's; the container only gets its cpu= share
+        cores = min(len(os.sched_getaffinity(0)), UPLOAD_TILES_CPU)
+        if num_points < POOL_MIN_ROWS:  # process start-up would cost more than it saves
+            cores = 1
         print("starting quadtree build")
 
-        qt = QuadTree(50, 50, 50, items)  # recall we normalized to 100x100
+        tree_cls = MortonQuadTree if quadtree_builder == "morton" else QuadTree
+        qt = build_quadtree(  # recall we normalized to 100x100
+            xy_path,
+            tree_cls,
+            workers=quadtree_workers or cores,
+            pool_depth=quadtree_pool_depth,
+            memory_budget=quadtree_memory_budget,
+            spill_dir=os.path.join(run_dir, "quadtree_spill"),
+        )
 
         print("quadtree built")
         qt.print_tree()
 
-        arrow_schema = make_arrow_schema(run_dir, vector_col, primary_key_col)
-        timestamp_cols = get_timestamp_cols(arrow_schema)
-        digest_by_col = get_digest_by_col(arrow_schema)
+        shard_dir = shard_dir or run_dir
+        arrow_schema = make_arrow_schema(shard_dir, vector_col, primary_key_col)
+
+        tile_order_dir = None
+        if cluster_tiles or state_dir:
+            # a refresh re-tiles from the tile order, so it outlives the run
+            tile_order_dir = os.path.join(state_dir or run_dir, "tile_order")
+            TileEncoder(
+                shard_dir, arrow_schema, vector_col, primary_key_col
+            ).write_tile_order(qt, tile_order_dir)
+            print("tile order written")
 
         uploader = TileUploader(
-            run_dir=run_dir,
+            shard_dir=shard_dir,
             projection_id=projection_id,
             supabase_client=supabase_client,
             arrow_schema=arrow_schema,
-            timestamp_cols=timestamp_cols,
-            digest_by_col=digest_by_col,
             metadata={},
             vector_col=vector_col,
             primary_key_col=primary_key_col,
+            upload_workers=upload_workers,
+            encode_workers=encode_workers or cores,
+            tile_order_dir=tile_order_dir,
         )
 
         uploader.recurse(qt)
+        uploader.close()
         updated_metadata = uploader.metadata
-        updated_digest_by_col = uploader.digest_by_col
+        color_stats = compute_color_stats(uploader.dataset, arrow_schema)
         num_rows = uploader.num_rows
 
         finalize_projection(
             updated_metadata,
-            updated_digest_by_col,
+            color_stats,
             projection_id,
             supabase_client,
             num_rows,
+            uploader.sink,
         )
 
+        if state_dir:
+            with open(os.path.join(state_dir, "tree.json"), "w") as f:
+                json.dump(updated_metadata["0/0_0"], f)
+            update_refresh_state(state_dir, color_stats=color_stats, num_rows=num_rows)
+            vol.commit()
+
         cleanup_volume.spawn(projection_id)
 
     except Exception as e:
@@ -275,6 +579,13 @@ def create_projection(
     database_id: str,
     total_rows: str,
     remaining_rows: str,
+    reducer: str | None = None,
+    refresh_col: str | None = None,
+    columns: str | None = None,
+    truncate: str | None = None,
+    halfvec: bool = False,
+    pre_reduce: str | None = None,  # "pca" or "random"
+    pre_reduce_dim: int = 64,
 ):
     orchestrator.spawn(
         schema,
@@ -285,47 +596,252 @@ def create_projection(
         database_id,
         total_rows,
         remaining_rows,
+        reducer,
+        refresh_col,
+        columns,
+        truncate,
+        halfvec,
+        pre_reduce,
+        pre_reduce_dim,
     )
     return {"status": "started"}  # return immidiately to avoid https timeout
 
 
-def run_wave(shard_ids, wave_size, const_kw):
+@app.function(image=modal.Image.debian_slim().pip_install("fastapi[standard]"))
+@modal.fastapi_endpoint(requires_proxy_auth=True)
+def refresh_projection(projection_id: str, remaining_rows: str):
+    """Fold rows changed since the last run into a projection made with a refresh_col."""
+    refresh_orchestrator.spawn(projection_id, remaining_rows)
+    return {"status": "started"}
+
+
+@app.function(image=modal.Image.debian_slim().pip_install("fastapi[standard]"))
+@modal.fastapi_endpoint(requires_proxy_auth=True)
+def delete_projection(projection_id: str):
+    """Drop everything kept on the volume for a deleted projection."""
+    cleanup_volume.spawn(projection_id, drop_state=True)
+    return {"status": "started"}
+
+
+@app.function(
+    image=modal.Image.debian_slim()
+    .pip_install("psycopg[binary]", "pyarrow", "numpy", "pgvector", "supabase")
+    .add_local_python_source("utils", "copy_decoder"),
+    secrets=[modal.Secret.from_name("supabase-credentials")],
+    volumes={MOUNT: vol},
+    timeout=7 * 60 * 60,
+)
+def refresh_orchestrator(projection_id: str, remaining_rows: str):
     """
-    Run shard_ids in batches of wave_size.
-    Return (failed_ids, ok_count).
+    Fetch the rows changed since the watermark, charge them to the user's
+    monthly rows like a new projection's, then place them.
     """
-    failed, ok = [], 0
-
-    for i in range(0, len(shard_ids), wave_size):
-        batch = shard_ids[i : i + wave_size]
-        results = list(
-            fetch_table.map(
-                batch,
-                kwargs=const_kw,
-                return_exceptions=True,
-            )
-        )
+    from utils import (
+        get_creds,
+        fetch_table_helper,
+        current_watermark,
+        changed_rows_plan,
+        read_refresh_state,
+        update_refresh_state,
+        check_and_update_usage,
+    )
+    from supabase import create_client
+    import os, shutil
 
-        for sid, res in zip(batch, results):
-            if isinstance(res, Exception):
-                msg = str(res).lower()
-                if "max client connections" in msg or "too many clients already" in msg:
-                    print(f"→ shard {sid} will be retried (pool limit hit)")
-                    failed.append(sid)
-                else:
-                    print(f"‼️ shard {sid} raised an unretryable error: {repr(res)}")
-                    raise res
-            else:
-                ok += 1
+    vol.reload()
+    state_dir = f"{REFRESH}/{projection_id}"
+    state = read_refresh_state(state_dir)
+    if "num_rows" not in state:
+        raise RuntimeError(f"projection {projection_id} has no finished run to refresh")
 
-    return failed, ok
+    creds = get_creds(state["database_id"])
+    schema, table = state["schema"], state["table"]
+    watermark = current_watermark(creds, schema, table, state["refresh_col"])
+
+    delta_dir = os.path.join(state_dir, "delta")
+    shutil.rmtree(delta_dir, ignore_errors=True)
+    fetch_table_helper(
+        0,
+        schema,
+        table,
+        state["vector_col"],
+        state["primary_key_col"],
+        changed_rows_plan(state["refresh_col"], state["watermark"]),
+        creds,
+        delta_dir,
+        columns=state.get("columns"),
+        truncate=state.get("truncate"),
+        halfvec=state.get("halfvec", False),
+    )
+
+    if os.path.getsize(os.path.join(delta_dir, "0.arrow")) == 0:  # nothing changed
+        update_refresh_state(state_dir, watermark=watermark)
+        shutil.rmtree(delta_dir)
+        vol.commit()
+        return
+
+    vol.commit()  # the usage check reloads the volume
+    supabase_client = create_client(
+        os.environ["SUPABASE_URL"],
+        os.environ["SUPABASE_KEY"],
+    )
+    try:
+        # nothing was charged up front, so every changed row counts
+        check_and_update_usage(
+            1, delta_dir, int(remaining_rows), state["database_id"], 0, supabase_client, vol
+        )  # will error if usage exceeded
+    except Exception:
+        shutil.rmtree(delta_dir)
+        vol.commit()
+        raise
+
+    update_refresh_state(state_dir, pending_watermark=watermark)
+    vol.commit()
+    if state["reducer"] == "cuml":
+        place_rows.spawn(projection_id)
+    else:
+        place_rows_cpu.spawn(projection_id)
+
+
+@app.function(
+    image=modal.Image.from_registry("rapidsai/base:25.04a-cuda12.8-py3.11")
+    .apt_install("build-essential")
+    .pip_install("scikit-learn")
+    .pip_install("numpy")
+    .pip_install("pyarrow")
+    .add_local_python_source("utils", "reducers"),
+    gpu="T4",
+    timeout=4 * 60 * 60,
+    volumes={MOUNT: vol},
+)
+def place_rows(projection_id: str):
+    """Project a refresh's changed rows with the saved cuML model."""
+    place_and_retile(projection_id)
+
+
+@app.function(
+    image=modal.Image.debian_slim()
+    .pip_install("umap-learn", "scikit-learn", "numpy", "pyarrow")
+    .add_local_python_source("utils", "reducers"),
+    cpu=8,
+    timeout=4 * 60 * 60,
+    volumes={MOUNT: vol},
+)
+def place_rows_cpu(projection_id: str):
+    """Project a refresh's changed rows with a saved CPU reducer."""
+    place_and_retile(projection_id)
+
+
+def place_and_retile(projection_id):
+    from utils import place_rows_helper, read_refresh_state
+
+    vol.reload()
+    state_dir = f"{REFRESH}/{projection_id}"
+    state = read_refresh_state(state_dir)
+    num_rows = place_rows_helper(state["vector_col"], state_dir)
+    print(f"placed {num_rows} changed rows")
+    vol.commit()
+    retile.spawn(projection_id)
+
+
+@app.function(
+    image=modal.Image.debian_slim()
+    .pip_install("pyarrow")
+    .pip_install("supabase")
+    .pip_install("zstandard")
+    .pip_install("boto3")
+    .pip_install("numpy")
+    .pip_install("scipy")
+    .pip_install("scikit-learn")
+    .add_local_python_source(
+        "tile_uploader_utils", "tile_uploader", "quadtree", "utils"
+    ),
+    secrets=[
+        modal.Secret.from_name("supabase-credentials"),
+        modal.Secret.from_name("cloudflare-credentials"),
+    ],
+    volumes={MOUNT: vol},
+    timeout=4 * 60 * 60,
+)
+def retile(projection_id: str, upload_workers: int = 16):
+    """Re-encode and upload only the tiles a refresh's changed rows touch."""
+    from tile_uploader import TileRefresher, UploadPipeline, flatten_tiles
+    from tile_uploader_utils import R2Sink, finalize_projection
+    from utils import read_refresh_state, update_refresh_state
+    from supabase import create_client
+    import os, json, shutil
+
+    supabase_client = create_client(
+        os.environ["SUPABASE_URL"],
+        os.environ["SUPABASE_KEY"],
+    )
+
+    vol.reload()
+    state_dir = f"{REFRESH}/{projection_id}"
+    state = read_refresh_state(state_dir)
+    with open(os.path.join(state_dir, "tree.json")) as f:
+        metadata = flatten_tiles(json.load(f))
+
+    refresher = TileRefresher(state_dir, metadata)
+    delta = refresher.load_delta(
+        os.path.join(state_dir, "delta"),
+        os.path.join(state_dir, "delta_xy.arrow"),
+        state["vector_col"],
+        state["primary_key_col"],
+    )
+    refresher.apply(delta)
+    print(f"{len(delta)} changed rows touch {len(refresher.changed)} tiles")
+
+    sink = R2Sink(max_connections=upload_workers)
+    uploads = UploadPipeline(sink, upload_workers)
+    refresher.upload(uploads, projection_id)
+    uploads.close()
+
+    # the old tile order is memory-mapped until the new one is written
+    new_order = os.path.join(state_dir, "tile_order.new")
+    refresher.write_tile_order(new_order)
+    del refresher.tile_order
+    shutil.rmtree(os.path.join(state_dir, "tile_order"))
+    os.rename(new_order, os.path.join(state_dir, "tile_order"))
+
+    finalize_projection(
+        metadata,
+        state["color_stats"],  # from the full run; a rerun refreshes them
+        projection_id,
+        supabase_client,
+        refresher.num_rows,
+        sink,
+    )
+
+    with open(os.path.join(state_dir, "tree.json"), "w") as f:
+        json.dump(metadata["0/0_0"], f)
+    update_refresh_state(
+        state_dir, watermark=state["pending_watermark"], num_rows=refresher.num_rows
+    )
+    shutil.rmtree(os.path.join(state_dir, "delta"))
+    os.remove(os.path.join(state_dir, "delta_xy.arrow"))
+    vol.commit()
 
 
 @app.function(
-    image=modal.Image.debian_slim(),
+    image=modal.Image.debian_slim().add_local_python_source("utils"),
     volumes={MOUNT: vol},
 )
-def cleanup_volume(projection_id: str):
+def cleanup_volume(projection_id: str, drop_state: bool = False):
+    """
+    Drop the projection's own files, and with drop_state its refresh state
+    too (only once the projection is deleted, refreshes need it otherwise).
+    Cached artifacts are shared between projections, so they are only
+    evicted by age and total size.
+    """
+    from utils import evict_artifacts
+    import shutil
+
     vol.reload()
-    vol.remove_file(f"{projection_id}", recursive=True)
+    shutil.rmtree(f"{MOUNT}/{projection_id}", ignore_errors=True)
+    if drop_state:
+        shutil.rmtree(f"{REFRESH}/{projection_id}", ignore_errors=True)
+    evicted = evict_artifacts(ARTIFACTS, ARTIFACT_TTL, ARTIFACT_MAX_BYTES)
+    if evicted:
+        print(f"evicted {len(evicted)} cached artifacts")
     vol.commit()
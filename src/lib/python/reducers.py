@@ -0,0 +1,311 @@
+from abc import ABC, abstractmethod
+
+
+class Reducer(ABC):
+    """
+    Turns the (N, dim) vectors memmap written by embed_to_2d_helper into an
+    (N, 2) float32 embedding, rows in the same order. The memmap is float16
+    for halfvec tables that are only read a batch at a time (landmark mode,
+    pca); reducers upcast what they read with as_float32.
+    """
+
+    name = None
+    knn = None  # (indices, distances, search index) to reuse, if the reducer can
+
+    @abstractmethod
+    def fit(self, sample):
+        """Fit on a subset of the rows, for transform() to place the rest."""
+
+    @abstractmethod
+    def transform(self, vectors):
+        """(n, dim) vectors -> (n, 2) float32, with the fitted model."""
+
+    def fit_transform(self, vectors):
+        self.fit(vectors)
+        return self.transform(vectors)
+
+
+class CumlUMAP(Reducer):
+    """UMAP on the GPU with cuML; nn-descent kNN batched over n_clusters."""
+
+    name = "cuml"
+
+    def __init__(self, n_neighbors=15, n_clusters=1):
+        self.n_neighbors = n_neighbors
+        self.n_clusters = n_clusters
+
+    def _umap(self):
+        from cuml.manifold import UMAP
+
+        return UMAP(
+            n_neighbors=self.n_neighbors,
+            n_components=2,
+            build_algo="nn_descent",
+            build_kwds={"nnd_do_batch": True, "nnd_n_clusters": self.n_clusters},
+            output_type="numpy",
+        )
+
+    def fit(self, sample):
+        self.umap = self._umap().fit(as_float32(sample), data_on_host=True)
+
+    def transform(self, vectors):
+        import numpy as np
+
+        return self.umap.transform(as_float32(vectors)).astype(np.float32)
+
+    def fit_transform(self, vectors):
+        import numpy as np
+
+        self.umap = self._umap()
+        X_low = self.umap.fit_transform(as_float32(vectors), data_on_host=True)
+        return X_low.astype(np.float32)
+
+
+class CpuUMAP(Reducer):
+    """umap-learn on every core: pynndescent kNN, then numba-parallel layout."""
+
+    name = "umap"
+
+    def __init__(self, n_neighbors=15, **_):
+        self.n_neighbors = n_neighbors
+
+    def _umap(self):
+        import umap
+
+        precomputed_knn = (None, None, None)
+        if self.knn is not None and self.knn[0].shape[1] >= self.n_neighbors:
+            indices, distances, search_index = self.knn
+            k = self.n_neighbors  # columns are sorted nearest first
+            precomputed_knn = (indices[:, :k], distances[:, :k], search_index)
+
+        return umap.UMAP(
+            n_neighbors=self.n_neighbors,
+            n_components=2,
+            low_memory=True,
+            n_jobs=-1,
+            precomputed_knn=precomputed_knn,
+        )
+
+    def _keep_knn(self):
+        # below 4096 rows umap-learn takes exact pairwise distances and keeps
+        # no kNN graph
+        indices = getattr(self.umap, "_knn_indices", None)
+        distances = getattr(self.umap, "_knn_dists", None)
+        if getattr(self.umap, "_small_data", False):
+            return
+        if self.knn is None and indices is not None and distances is not None:
+            self.knn = (
+                indices,
+                distances,
+                getattr(self.umap, "_knn_search_index", None),
+            )
+
+    def fit(self, sample):
+        self.umap = self._umap().fit(as_float32(sample))
+        self._keep_knn()
+
+    def transform(self, vectors):
+        import numpy as np
+
+        return self.umap.transform(as_float32(vectors)).astype(np.float32)
+
+    def fit_transform(self, vectors):
+        import numpy as np
+
+        self.umap = self._umap()
+        X_low = self.umap.fit_transform(as_float32(vectors)).astype(np.float32)
+        self._keep_knn()
+        return X_low
+
+
+class PCAPreview(Reducer):
+    """
+    Top two principal components, fitted and projected a batch at a time.
+    Seconds instead of minutes, for previews; clusters overlap far more than
+    with UMAP.
+    """
+
+    name = "pca"
+
+    def __init__(self, batch_rows=100_000, **_):
+        self.batch_rows = batch_rows
+
+    def fit(self, sample):
+        from sklearn.decomposition import IncrementalPCA
+
+        batch_rows = max(self.batch_rows, 2)
+        self.pca = IncrementalPCA(n_components=2)
+        for lo in range(0, len(sample), batch_rows):
+            batch = as_float32(sample[lo : lo + batch_rows])
+            if len(batch) >= 2:  # a trailing single row can't be fitted on its own
+                self.pca.partial_fit(batch)
+
+    def transform(self, vectors):
+        import numpy as np
+
+        out = np.empty((len(vectors), 2), dtype=np.float32)
+        for lo in range(0, len(vectors), self.batch_rows):
+            out[lo : lo + self.batch_rows] = self.pca.transform(
+                as_float32(vectors[lo : lo + self.batch_rows])
+            )
+        return out
+
+
+REDUCERS = {cls.name: cls for cls in (CumlUMAP, CpuUMAP, PCAPreview)}
+
+
+def check_reducer(name: str) -> None:
+    """Fail fast on a reducer name REDUCERS doesn't have, before any fetching."""
+    if name not in REDUCERS:
+        raise ValueError(
+            f"unknown reducer {name!r}, expected one of {', '.join(sorted(REDUCERS))}"
+        )
+
+
+def as_float32(vectors):
+    """vectors as a float32 array; a copy only if they're float16"""
+    import numpy as np
+
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def stratified_sample(num_rows: int, sample_rows: int, seed: int = 0):
+    """
+    Sorted row indices, one picked at random from each of sample_rows equal
+    slices of the table. Rows are in shard order, so every shard (and every
+    stretch of primary keys) is represented in proportion.
+    """
+    import numpy as np
+
+    edges = np.linspace(0, num_rows, sample_rows + 1).astype(np.int64)
+    offsets = np.random.default_rng(seed).random(sample_rows) * np.diff(edges)
+    return edges[:-1] + offsets.astype(np.int64)
+
+
+def run_reducer(
+    name: str,
+    options: dict,
+    mmap_path: str,
+    shape: tuple[int, int],
+    result_path: str,
+    landmark_rows: int | None = None,
+    batch_rows: int = 100_000,
+    model_path: str | None = None,  # pickle the fitted reducer here
+    knn_path: str | None = None,  # kNN graph of these vectors, reused if present
+    dtype: str = "float32",  # of the memmap, "float16" for halfvec tables
+) -> None:
+    """
+    Child process entry point.
+    Reads the memory-map, runs the named reducer, writes a .npy file with (N,2) floats.
+
+    With landmark_rows the reducer is fitted on a stratified sample of that
+    many rows only, and every row is then placed by transform() a batch at a
+    time, straight into the memory-mapped .npy.
+    """
+    # Everything heavy is imported **inside** the reducer so that the fork/spawn
+    # does not pull GPU state into the parent.
+    import numpy as np
+    import os, pickle
+
+    vectors = np.memmap(mmap_path, dtype=dtype, mode="r", shape=shape)
+    reducer = REDUCERS[name](**options)
+    num_rows = shape[0]
+
+    if landmark_rows is None or num_rows <= landmark_rows:
+        if knn_path is not None and os.path.exists(knn_path):
+            with open(knn_path, "rb") as f:
+                reducer.knn = pickle.load(f)
+            print("reusing cached kNN graph")
+        np.save(result_path, reducer.fit_transform(vectors))
+        if knn_path is not None and reducer.knn is not None:
+            if not os.path.exists(knn_path):
+                save_pickle(reducer.knn, knn_path)
+    else:
+        # the kNN graph of a sample is cheap, and only valid for that sample
+        reducer.fit(vectors[stratified_sample(num_rows, landmark_rows)])
+        print(f"fitted {name} on {landmark_rows} of {num_rows} rows")
+
+        out = np.lib.format.open_memmap(
+            result_path, mode="w+", dtype=np.float32, shape=(num_rows, 2)
+        )
+        for lo in range(0, num_rows, batch_rows):
+            out[lo : lo + batch_rows] = reducer.transform(
+                vectors[lo : lo + batch_rows]
+            )
+        out.flush()
+
+    if model_path is not None:
+        save_pickle(reducer, model_path)
+
+
+def save_pickle(obj, path):
+    """pickle to path through a rename, so readers never see half a file"""
+    import os, pickle, tempfile
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def fit_pre_reducer(kind: str, n_components: int, dim: int, sample_batches):
+    """
+    Linear map from dim down to n_components, applied to the vectors before
+    the 2D reducer ever sees them.
+
+    "pca" fits IncrementalPCA one sample batch at a time (every batch needs
+    at least n_components rows). "random" is a sparse random projection and
+    only needs the input dimension, so the sample isn't read at all.
+    Returns a fitted sklearn transformer.
+    """
+    import numpy as np
+
+    if kind == "random":
+        from sklearn.random_projection import SparseRandomProjection
+
+        projection = SparseRandomProjection(
+            n_components=n_components, dense_output=True, random_state=0
+        )
+        return projection.fit(np.zeros((1, dim), dtype=np.float32))
+
+    if kind == "pca":
+        from sklearn.decomposition import IncrementalPCA
+
+        pca = IncrementalPCA(n_components=n_components)
+        for batch in sample_batches:
+            pca.partial_fit(batch)
+        return pca
+
+    raise ValueError(f"unknown pre-reduction {kind}")
+
+
+def run_transform(
+    state_dir: str,
+    mmap_path: str,
+    shape: tuple[int, int],
+    result_path: str,
+    batch_rows: int = 100_000,
+) -> None:
+    """
+    Child process entry point for incremental refresh: place new vectors with
+    the pre-reducer and reducer a full run pickled into state_dir.
+    """
+    import numpy as np
+    import os, pickle
+
+    vectors = np.memmap(mmap_path, dtype=np.float32, mode="r", shape=shape)
+    with open(os.path.join(state_dir, "reducer.pkl"), "rb") as f:
+        reducer = pickle.load(f)
+    pre_reducer = None
+    if os.path.exists(os.path.join(state_dir, "pre_reducer.pkl")):
+        with open(os.path.join(state_dir, "pre_reducer.pkl"), "rb") as f:
+            pre_reducer = pickle.load(f)
+
+    out = np.empty((shape[0], 2), dtype=np.float32)
+    for lo in range(0, shape[0], batch_rows):
+        batch = as_float32(vectors[lo : lo + batch_rows])
+        if pre_reducer is not None:
+            batch = pre_reducer.transform(batch).astype(np.float32)
+        out[lo : lo + batch_rows] = reducer.transform(batch)
+    np.save(result_path, out)
@@ -0,0 +1,4 @@
+import os, sys
+
+# the modal functions import these modules flat, from src/lib/python
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+import json, os, time
+
+from utils import evict_artifacts, lease_artifacts, publish_shards, read_manifest
+
+
+def make_entry(root, key, last_used, **fields):
+    path = os.path.join(root, key)
+    os.makedirs(os.path.join(path, "shards"))
+    with open(os.path.join(path, "shards", "0.arrow"), "wb") as f:
+        f.write(b"x" * 10)
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump({"num_shards": 1, "last_used": last_used, **fields}, f)
+    return path
+
+
+def test_leased_entries_are_not_evicted(tmp_path):
+    root = str(tmp_path)
+    month_ago = time.time() - 30 * 24 * 60 * 60
+    leased = make_entry(root, "leased", month_ago, leased_until=time.time() + 60)
+    make_entry(root, "stale", month_ago)
+
+    assert evict_artifacts(root, ttl=60, max_bytes=0, min_age=0) == ["stale"]
+    assert os.path.isdir(leased)
+
+
+def test_lease_extends_and_stamps(tmp_path):
+    entry = make_entry(str(tmp_path), "key", 0, leased_until=time.time() + 600)
+    lease_artifacts(entry, 60)
+    manifest = read_manifest(entry)
+    assert manifest["leased_until"] > time.time() + 500  # never shortened
+    assert manifest["last_used"] > time.time() - 60
+
+
+def test_publish_keeps_the_first_fetch(tmp_path):
+    artifact_dir = str(tmp_path / "artifacts" / "key")
+    first, second = tmp_path / "run1" / "shards", tmp_path / "run2" / "shards"
+    for run in (first, second):
+        run.mkdir(parents=True)
+        (run / "0.arrow").write_bytes(run.parent.name.encode())
+
+    published = publish_shards(str(first), artifact_dir)
+    assert published == os.path.join(artifact_dir, "shards")
+    assert publish_shards(str(second), artifact_dir) == str(second)
+    with open(os.path.join(published, "0.arrow"), "rb") as f:
+        assert f.read() == b"run1"
+    assert (second / "0.arrow").read_bytes() == b"run2"
@@ -0,0 +1,102 @@
+import os, threading
+
+import pytest
+
+from utils import split_connections
+
+DSN = os.environ.get("FETCH_TEST_DSN")  # e.g. postgresql://postgres@localhost/test
+
+
+@pytest.mark.parametrize("per_container", [1, 4, 7])
+def test_split_connections_stays_in_budget(per_container):
+    for budget in range(1, 200):
+        containers, each = split_connections(budget, per_container)
+        assert containers * each <= budget
+        assert each <= per_container
+        # and doesn't leave more than a container's worth unused
+        assert budget - containers * each < containers
+
+
+@pytest.fixture
+def table():
+    if not DSN:
+        pytest.skip("set FETCH_TEST_DSN to run against postgres")
+    psycopg = pytest.importorskip("psycopg")
+    pytest.importorskip("psycopg_pool")
+    from psycopg.conninfo import conninfo_to_dict
+
+    name = f"fetch_test_{os.getpid()}"
+    with psycopg.connect(DSN, autocommit=True) as pg:
+        try:
+            pg.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        except psycopg.Error:
+            pytest.skip("pgvector isn't available")
+        pg.execute(
+            f"""
+            CREATE TABLE public.{name} AS
+            SELECT i::int8 AS id,
+                   ('[' || i || ',1,2,3]')::vector(4) AS emb,
+                   'row ' || i AS name
+            FROM generate_series(1, 20000) i
+        """
+        )
+        pg.execute(f"ALTER TABLE public.{name} ADD PRIMARY KEY (id)")
+        pg.execute(f"ANALYZE public.{name}")
+    yield conninfo_to_dict(DSN), name
+    with psycopg.connect(DSN, autocommit=True) as pg:
+        pg.execute(f"DROP TABLE public.{name}")
+
+
+def test_fetcher_reads_every_row_once_within_budget(table, tmp_path):
+    import pyarrow.dataset as ds
+    from utils import (
+        AdaptiveFetcher,
+        SharedSnapshot,
+        fetch_shards_helper,
+        plan_shards,
+    )
+
+    creds, name = table
+    budget = 5
+    containers, per_container = split_connections(budget, 4)
+    in_flight = peak = 0
+    lock = threading.Lock()
+
+    with SharedSnapshot(creds) as snapshot:
+        plan = plan_shards(
+            creds, "public", name, "id", 12, allow_ctid=snapshot.id is not None
+        )
+
+        def fetch(shard_ids):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += per_container
+                peak = max(peak, in_flight)
+            try:
+                return fetch_shards_helper(
+                    shard_ids,
+                    "public",
+                    name,
+                    "emb",
+                    "id",
+                    plan,
+                    creds,
+                    str(tmp_path),
+                    connections=per_container,
+                    snapshot=snapshot.id,
+                )
+            finally:
+                with lock:
+                    in_flight -= per_container
+
+        batches = [
+            list(range(lo, min(lo + per_container, len(plan))))
+            for lo in range(0, len(plan), per_container)
+        ]
+        AdaptiveFetcher(fetch, max_concurrency=containers).run(batches)
+
+    assert peak <= budget
+    shards = [str(p) for p in tmp_path.glob("*.arrow") if p.stat().st_size]
+    ids = ds.dataset(shards, format="arrow").to_table(columns=["id"])
+    assert ids.num_rows == 20000
+    assert len(set(ids.column("id").to_pylist())) == 20000
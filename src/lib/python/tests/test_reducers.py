@@ -0,0 +1,106 @@
+import os, pickle
+
+import numpy as np
+import pytest
+
+from reducers import check_reducer, run_reducer
+
+
+def write_memmap(path, vectors):
+    mmap = np.memmap(path, dtype=np.float32, mode="w+", shape=vectors.shape)
+    mmap[:] = vectors
+    mmap.flush()
+
+
+def test_cpu_umap_small_table(tmp_path):
+    pytest.importorskip("umap")
+    vectors = np.random.default_rng(0).standard_normal((300, 16)).astype(np.float32)
+    mmap_path = str(tmp_path / "vectors.mmp")
+    write_memmap(mmap_path, vectors)
+
+    result_path = str(tmp_path / "xy.npy")
+    knn_path = str(tmp_path / "knn.pkl")
+    model_path = str(tmp_path / "reducer.pkl")
+    run_reducer(
+        "umap",
+        {"n_neighbors": 15},
+        mmap_path,
+        vectors.shape,
+        result_path,
+        model_path=model_path,
+        knn_path=knn_path,
+    )
+
+    xy = np.load(result_path)
+    assert xy.shape == (300, 2) and xy.dtype == np.float32
+    assert not os.path.exists(knn_path)  # umap-learn keeps no graph this small
+    with open(model_path, "rb") as f:
+        assert pickle.load(f).knn is None
+
+
+class FakeCumlUMAP:
+    """stands in for cuml.manifold.UMAP: projects onto the first two dims"""
+
+    def __init__(self, **kwargs):
+        self.fitted = False
+
+    def fit(self, X, data_on_host=False):
+        self.fitted = True
+        return self
+
+    def fit_transform(self, X, data_on_host=False):
+        return self.fit(X).transform(X)
+
+    def transform(self, X):
+        assert self.fitted, "transform before fit"
+        return X[:, :2] * 2
+
+
+@pytest.fixture
+def fake_cuml(monkeypatch):
+    import sys, types
+
+    manifold = types.ModuleType("cuml.manifold")
+    manifold.UMAP = FakeCumlUMAP
+    cuml = types.ModuleType("cuml")
+    cuml.manifold = manifold
+    monkeypatch.setitem(sys.modules, "cuml", cuml)
+    monkeypatch.setitem(sys.modules, "cuml.manifold", manifold)
+
+
+@pytest.mark.parametrize("name", ["cuml", "pca"])
+def test_refresh_transform_from_pickled_reducer(tmp_path, name, fake_cuml):
+    from reducers import run_transform
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 8)).astype(np.float32)
+    mmap_path = str(tmp_path / "vectors.mmp")
+    write_memmap(mmap_path, vectors)
+    state_dir = tmp_path / "state"
+
+    run_reducer(
+        name,
+        {"n_neighbors": 15},
+        mmap_path,
+        vectors.shape,
+        str(tmp_path / "xy.npy"),
+        model_path=str(state_dir / "reducer.pkl"),
+    )
+
+    # refresh: new rows through the pickled model
+    delta = rng.standard_normal((40, 8)).astype(np.float32)
+    delta_path = str(tmp_path / "delta.mmp")
+    write_memmap(delta_path, delta)
+    run_transform(str(state_dir), delta_path, delta.shape, str(tmp_path / "delta.npy"))
+
+    with open(state_dir / "reducer.pkl", "rb") as f:
+        expected = pickle.load(f).transform(delta)
+    placed = np.load(tmp_path / "delta.npy")
+    assert placed.shape == (40, 2)
+    np.testing.assert_allclose(placed, expected, rtol=1e-5)
+
+
+def test_unknown_reducer_names_the_choices():
+    check_reducer("pca")
+    with pytest.raises(ValueError, match="cuml, pca, umap"):
+        check_reducer("tsne")
@@ -0,0 +1,112 @@
+import glob, json, os
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+zstd = pytest.importorskip("zstandard")
+
+import quadtree
+from quadtree import build_quadtree
+from tile_uploader import TileEncoder, TileUploader
+from tile_uploader_utils import LocalSink, make_arrow_schema
+from utils import write_normalized_xy
+
+
+def write_run(run_dir):
+    """three shards and an xy.arrow of clustered points, like a reduce run"""
+    rng = np.random.default_rng(0)
+    num_rows, per_shard = 30_000, 10_000
+    for shard in range(num_rows // per_shard):
+        ids = np.arange(shard * per_shard, (shard + 1) * per_shard)
+        names = [None if i % 7 == 0 else f"row {i}" for i in ids]
+        table = pa.table(
+            {
+                "id": ids,
+                "emb": pa.FixedSizeListArray.from_arrays(
+                    pa.array(rng.random(len(ids) * 4, dtype=np.float32)), 4
+                ),
+                "name": pa.array(names),
+                "score": rng.random(len(ids)),
+            }
+        )
+        with pa.ipc.new_file(str(run_dir / f"{shard}.arrow"), table.schema) as w:
+            w.write_table(table, max_chunksize=3_000)
+
+    centers = rng.integers(0, 4, (num_rows, 1))
+    clustered = rng.standard_normal((num_rows, 2)) * [1, 3] + centers
+    write_normalized_xy(clustered.astype(np.float32), str(run_dir / "xy.arrow"))
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    write_run(tmp_path)
+    return tmp_path
+
+
+def upload(run_dir, qt, out_dir, tile_order_dir=None):
+    schema = make_arrow_schema(str(run_dir), "emb", "id")
+    uploader = TileUploader(
+        str(run_dir),
+        "p",
+        None,
+        schema,
+        {},
+        "emb",
+        "id",
+        sink=LocalSink(str(out_dir)),
+        tile_order_dir=tile_order_dir,
+    )
+    uploader.recurse(qt)
+    uploader.close()
+
+    tiles = {}
+    for path in glob.glob(str(out_dir / "p" / "tiles" / "*" / "*")):
+        with open(path, "rb") as f:
+            data = zstd.ZstdDecompressor().decompressobj().decompress(f.read())
+        tiles[os.path.relpath(path, out_dir)] = pa.ipc.open_file(data).read_all()
+    return tiles, json.loads(json.dumps(uploader.metadata))
+
+
+def pop_sizes(metadata):
+    """strip the byte sizes from every tile entry, nested ones too; {tile_id: sizes}"""
+    sizes = {}
+
+    def strip(entry):
+        sizes[entry["tile_id"]] = (
+            entry.pop("uncompressed_size"),
+            entry.pop("compressed_size"),
+        )
+        for child in entry["children"]:
+            strip(child)
+
+    for entry in metadata.values():
+        strip(entry)
+    return sizes
+
+
+def test_tile_order_matches_gather(run_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(quadtree.QuadTree, "MAX_TILE_POINTS", 4_000)
+    qt = build_quadtree(str(run_dir / "xy.arrow"))
+    gathered, gathered_meta = upload(run_dir, qt, tmp_path / "gather")
+
+    schema = make_arrow_schema(str(run_dir), "emb", "id")
+    order_dir = str(run_dir / "tile_order")
+    TileEncoder(str(run_dir), schema, "emb", "id").write_tile_order(
+        qt, order_dir, chunk_rows=5_000
+    )
+    ordered, ordered_meta = upload(run_dir, qt, tmp_path / "ordered", order_dir)
+
+    assert len(gathered) > 1
+    assert gathered.keys() == ordered.keys()
+    for key in gathered:
+        assert gathered[key].equals(ordered[key])
+
+    # a slice of tiles.arrow keeps its parent's buffers, which the writer pads
+    # to 8 bytes each, so its file can come out a few bytes bigger than a
+    # freshly gathered tile's
+    gathered_sizes, ordered_sizes = pop_sizes(gathered_meta), pop_sizes(ordered_meta)
+    assert ordered_meta == gathered_meta
+    for tile_id, (uncompressed, compressed) in gathered_sizes.items():
+        assert 0 <= ordered_sizes[tile_id][0] - uncompressed <= 64
+        assert abs(ordered_sizes[tile_id][1] - compressed) <= 64
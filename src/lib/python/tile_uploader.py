@@ -1,155 +1,521 @@
-from tile_uploader_utils import upload_to_r2
+from tile_uploader_utils import R2Sink, encode_tile, tile_path
 
 
-class TileUploader:
+class UploadPipeline:
+    """
+    Runs sink.put on a thread pool so the next tile can be encoded while the
+    previous ones are still uploading. submit() blocks once max_inflight_bytes
+    of tiles are queued or uploading.
+    """
+
+    def __init__(self, sink, workers=16, max_inflight_bytes=256 * 1024**2):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.sink = sink
+        self.max_inflight_bytes = max_inflight_bytes
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.cond = threading.Condition()
+        self.inflight_bytes = 0
+        self.error = None
+
+    def submit(self, remote_path, data: bytes):
+        size = len(data)
+        with self.cond:
+            # a tile bigger than the whole budget still goes, just on its own
+            self.cond.wait_for(
+                lambda: self.error is not None
+                or self.inflight_bytes == 0
+                or self.inflight_bytes + size <= self.max_inflight_bytes
+            )
+            if self.error is not None:
+                raise self.error
+            self.inflight_bytes += size
+
+        future = self.pool.submit(self.sink.put, remote_path, data)
+        future.add_done_callback(lambda f: self._done(f, size))
+
+    def _done(self, future, size):
+        with self.cond:
+            self.inflight_bytes -= size
+            if future.exception() is not None and self.error is None:
+                self.error = future.exception()
+            self.cond.notify_all()
+
+    def close(self):
+        """Wait for every upload, raising the first failure."""
+        self.pool.shutdown(wait=True)
+        if self.error is not None:
+            raise self.error
+
+
+class TileEncoder:
+    """
+    Turns a tile's rows into encoded bytes. The shards are memory-mapped, so
+    encoders in several processes share one copy in the page cache.
+    """
 
     def __init__(
         self,
-        run_dir: str,
-        projection_id: str,
-        supabase_client,
+        shard_dir: str,
         arrow_schema,
-        timestamp_cols: list[str],
-        digest_by_col,
-        metadata: dict,
         vector_col: str,
         primary_key_col: str,
-        output_dir="/tmp/tiles",
+        tile_order_dir: str | None = None,  # written by write_tile_order
     ):
-        import os, glob, pyarrow.dataset as ds
+        import os, glob, json, pyarrow as pa, pyarrow.dataset as ds
+        from pyarrow import fs
 
-        self.run_dir = run_dir
-        self.projection_id = projection_id
-        self.supabase_client = supabase_client
         self.arrow_schema = arrow_schema
-        self.timestamp_cols = timestamp_cols
-        self.digest_by_col = digest_by_col
-        self.metadata = metadata
-        self.output_dir = output_dir
-        self.primary_key_col = primary_key_col
         self.vector_col = vector_col
+        self.primary_key_col = primary_key_col
 
         data_files = [
             f
-            for f in glob.glob(os.path.join(run_dir, "*.arrow"))
+            for f in glob.glob(os.path.join(shard_dir, "*.arrow"))
             if not f.endswith("xy.arrow")
         ]
-        self.dataset = ds.dataset(data_files, format="arrow")
-        self.num_rows = self.dataset.count_rows()
+        self.dataset = ds.dataset(
+            data_files, format="arrow", filesystem=fs.LocalFileSystem(use_mmap=True)
+        )
 
-    def _upload_tile(self, tile_id, points):  # points is in form: [[x, y, pk],...]
-        import pyarrow as pa
-        import pyarrow.feather as feather
-        import os
-        import zstandard as zstd
-        from datetime import timezone
-        import decimal
-        import gc
+        self.tile_order = self.tile_offsets = None
+        if tile_order_dir is not None:
+            source = pa.memory_map(os.path.join(tile_order_dir, "tiles.arrow"))
+            self.tile_order = pa.ipc.open_file(source).read_all()  # zero copy
+            with open(os.path.join(tile_order_dir, "offsets.json")) as f:
+                self.tile_offsets = json.load(f)
 
-        print("uploading tile")
-        os.makedirs(self.output_dir, exist_ok=True)
-
-        # extract the list of row‐indices
-        indices = [int(pt[2]) for pt in points]
-        # pull exactly those rows from the dataset
-        subset: pa.Table = self.dataset.take(indices)
-
-        if self.vector_col in subset.column_names:
-            subset = subset.drop([self.vector_col])
-
-        new_names = []
-        for name in subset.column_names:
-            if name == self.primary_key_col:
-                new_names.append("ix")
-            else:
-                new_names.append(f"user_{name}")
-        subset = subset.rename_columns(new_names)
-
-        # turn into a dict-of‐lists so we can look up row‐i by its position
-        data = subset.to_pydict()
-
-        combined = []
-        for idx, (x, y, _) in enumerate(points):
-            row = {col: data[col][idx] for col in data}
-            row["x"] = x
-            row["y"] = y
-            combined.append(row)
-
-        for row in combined:
-            for col, td in self.digest_by_col.items():
-                v = row.get(col)
-                if v is None:
+    def encode(self, tile_id, xs=None, ys=None, indices=None):
+        """
+        Returns (bytes, uncompressed_size) for the tile. With a tile order the
+        rows are a slice of tiles.arrow and the columns aren't needed.
+        """
+        if self.tile_order is not None:
+            offset, length = self.tile_offsets[tile_id]
+            table = self.tile_order.slice(offset, length)
+        else:
+            table = self.gather_tile(xs, ys, indices)
+        return encode_tile(table)
+
+    def write_tile_order(self, qtree, out_dir, chunk_rows=1 << 20):
+        """
+        Rewrite the shards as one arrow file holding every tile's rows, already
+        shaped for upload, in the order recurse visits the tiles. offsets.json
+        maps tile id -> [first row, row count].
+        """
+        import os, json, numpy as np, pyarrow as pa
+
+        os.makedirs(out_dir, exist_ok=True)
+        offsets, buffered, buffered_rows, written = {}, [], 0, 0
+
+        with pa.ipc.new_file(
+            os.path.join(out_dir, "tiles.arrow"), self.arrow_schema
+        ) as writer:
+            for tile_id, node in walk_tiles(qtree):
+                cols = node.node_columns()
+                offsets[tile_id] = [written + buffered_rows, len(cols[2])]
+                buffered.append(cols)
+                buffered_rows += len(cols[2])
+                if buffered_rows < chunk_rows:
                     continue
-                if isinstance(v, decimal.Decimal):
-                    row[col] = float(v)
-                if col in self.timestamp_cols:
-                    if v.tzinfo is None:
-                        v = v.replace(tzinfo=timezone.utc)
-                    td.update(v.timestamp() * 1e3)
-                else:
-                    td.update(float(v))
-
-        print("table ready, tdigest updated")
-
-        out_table = pa.Table.from_pylist(combined, schema=self.arrow_schema)
-        uncompressed_filename = os.path.join(
-            self.output_dir, f"{tile_id.replace('/', '_')}.arrow"
-        )
-        feather.write_feather(
-            out_table, uncompressed_filename, compression="uncompressed"
+                # one gather per chunk of tiles instead of one per tile
+                xs, ys, indices = (np.concatenate(c) for c in zip(*buffered))
+                writer.write_table(self.gather_tile(xs, ys, indices))
+                written += buffered_rows
+                buffered, buffered_rows = [], 0
+
+            if buffered:
+                xs, ys, indices = (np.concatenate(c) for c in zip(*buffered))
+                writer.write_table(self.gather_tile(xs, ys, indices))
+
+        with open(os.path.join(out_dir, "offsets.json"), "w") as f:
+            json.dump(offsets, f)
+
+    def gather_tile(self, xs, ys, indices):
+        """Pull the tile's rows from the dataset and shape them to arrow_schema."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import numpy as np
+
+        # gather in file order (much kinder to the page cache), then put the
+        # rows back in tile order; the vector column is never read
+        columns = [n for n in self.dataset.schema.names if n != self.vector_col]
+        order = np.argsort(indices, kind="stable")
+        subset: pa.Table = self.dataset.take(indices[order], columns=columns)
+        subset = subset.take(np.argsort(order))
+
+        subset = subset.rename_columns(
+            [
+                "ix" if name == self.primary_key_col else f"user_{name}"
+                for name in subset.column_names
+            ]
         )
-        uncompressed_size = os.path.getsize(uncompressed_filename)
+        subset = subset.append_column("x", pa.array(xs, type=pa.float32()))
+        subset = subset.append_column("y", pa.array(ys, type=pa.float32()))
+
+        columns = []
+        for field in self.arrow_schema:
+            col = subset.column(field.name)
+            if pa.types.is_decimal(col.type):
+                # through float64 so values round the same as float(Decimal) did
+                col = pc.cast(col, pa.float64())
+            if col.type != field.type:
+                # us -> ms timestamps and float64 -> float32 are lossy on purpose
+                col = pc.cast(col, field.type, safe=False)
+            columns.append(col)
+        return pa.Table.from_arrays(columns, schema=self.arrow_schema)
+
+
+_worker_encoder = None  # set in each encode worker by _init_encode_worker
+
+
+def _init_encode_worker(*encoder_args):
+    global _worker_encoder
+    _worker_encoder = TileEncoder(*encoder_args)
+
+
+def _encode_in_worker(tile_id, xs, ys, indices):
+    return _worker_encoder.encode(tile_id, xs, ys, indices)
 
-        compressed_filename = uncompressed_filename + ".zst"
-        cctx = zstd.ZstdCompressor()
-        with open(uncompressed_filename, "rb") as f_in, open(
-            compressed_filename, "wb"
-        ) as f_out:
-            f_out.write(cctx.compress(f_in.read()))
 
-        compressed_file_size = os.path.getsize(compressed_filename)
+def child_tile_ids(tile_id):
+    """ids of a tile's four children, in the same order as QuadTree.children"""
+    z, coords = tile_id.split("/", 1)
+    x, y = map(int, coords.split("_"))
+    return [
+        f"{int(z)+1}/{2*x}_{2*y}",
+        f"{int(z)+1}/{2*x}_{2*y+1}",
+        f"{int(z)+1}/{2*x+1}_{2*y}",
+        f"{int(z)+1}/{2*x+1}_{2*y+1}",
+    ]
 
-        remote_path = f"{self.projection_id}/tiles/{tile_id}.arrow.zst"
-        upload_to_r2(compressed_filename, remote_path)
 
-        tile_metadata = {
+def walk_tiles(qtree, tile_id="0/0_0"):
+    """Yield (tile_id, node) for every non-empty node, in the order recurse visits them."""
+    if len(qtree.nodes):
+        yield tile_id, qtree
+    for child, child_id in zip(qtree.children or [], child_tile_ids(tile_id)):
+        yield from walk_tiles(child, child_id)
+
+
+class TileUploader:
+
+    def __init__(
+        self,
+        shard_dir: str,
+        projection_id: str,
+        supabase_client,
+        arrow_schema,
+        metadata: dict,
+        vector_col: str,
+        primary_key_col: str,
+        sink=None,  # defaults to the r2 bucket
+        upload_workers: int = 16,
+        max_inflight_bytes: int = 256 * 1024**2,
+        encode_workers: int = 1,  # > 1 encodes tiles in a process pool
+        tile_order_dir: (
+            str | None
+        ) = None,  # read tiles from TileEncoder.write_tile_order
+    ):
+        import multiprocessing as mp
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.shard_dir = shard_dir
+        self.projection_id = projection_id
+        self.supabase_client = supabase_client
+        self.arrow_schema = arrow_schema
+        self.metadata = metadata
+        self.primary_key_col = primary_key_col
+        self.vector_col = vector_col
+        self.sink = sink or R2Sink(max_connections=upload_workers)
+        self.uploads = UploadPipeline(self.sink, upload_workers, max_inflight_bytes)
+
+        encoder_args = (
+            shard_dir,
+            arrow_schema,
+            vector_col,
+            primary_key_col,
+            tile_order_dir,
+        )
+        self.encoder = TileEncoder(*encoder_args)
+        self.dataset = self.encoder.dataset
+        self.num_rows = self.dataset.count_rows()
+
+        self.encode_pool = None
+        self.pending = deque()  # (tile_id, future) in the order tiles were visited
+        self.max_pending = 2 * encode_workers
+        if encode_workers > 1:
+            self.encode_pool = ProcessPoolExecutor(
+                max_workers=encode_workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_encode_worker,
+                initargs=encoder_args,
+            )
+
+    def _upload_tile(self, tile_id, xs, ys, indices):  # column arrays for the tile
+        import gc
+
+        # sizes are filled in once the tile is encoded; the dict is shared with
+        # the parent's children list so the tree sees them too
+        self.metadata[tile_id] = {
             "tile_id": tile_id,
             "uncompressed_size": 0,
             "compressed_size": 0,
             "children": [],
-            "node_count": len(points),
+            "node_count": len(indices),
         }
 
-        tile_metadata["uncompressed_size"] = uncompressed_size
-        tile_metadata["compressed_size"] = compressed_file_size
-        self.metadata[tile_id] = tile_metadata
-        print("done uploading tile")
+        if self.encode_pool is not None:
+            if self.encoder.tile_order is not None:
+                xs = ys = indices = None  # the worker only needs the tile id
+            future = self.encode_pool.submit(
+                _encode_in_worker, tile_id, xs, ys, indices
+            )
+            self.pending.append((tile_id, future))
+            while len(self.pending) > self.max_pending:
+                self._drain_one()
+            return
 
-        del subset, data, combined, out_table
+        print("uploading tile")
+        self._queue_upload(tile_id, *self.encoder.encode(tile_id, xs, ys, indices))
         gc.collect()
 
+    def _drain_one(self):
+        tile_id, future = self.pending.popleft()
+        self._queue_upload(tile_id, *future.result())
+
+    def _queue_upload(self, tile_id, data, uncompressed_size):
+        self.uploads.submit(tile_path(self.projection_id, tile_id), data)
+        self.metadata[tile_id]["uncompressed_size"] = uncompressed_size
+        self.metadata[tile_id]["compressed_size"] = len(data)
+        print("tile queued for upload")
+
+    def close(self):
+        """Block until every tile has been encoded and uploaded."""
+        try:
+            while self.pending:
+                self._drain_one()
+        finally:
+            if self.encode_pool is not None:
+                self.encode_pool.shutdown(cancel_futures=True)
+            self.uploads.close()
+
     def recurse(self, qtree, tile_id="0/0_0"):
         """
         Walk the quad‐tree, calling _upload_tile on each leaf, building out
-        metadata and digest_by_columns as you go.
+        metadata as you go.
         """
-        if qtree.nodes:
-            pts = qtree.nodes
-            self._upload_tile(tile_id, pts)
+        if len(qtree.nodes):
+            self._upload_tile(tile_id, *qtree.node_columns())
 
         if qtree.children:
-            z, coords = tile_id.split("/", 1)
-            x, y = map(int, coords.split("_"))
-            child_ids = [
-                f"{int(z)+1}/{2*x}_{2*y}",
-                f"{int(z)+1}/{2*x}_{2*y+1}",
-                f"{int(z)+1}/{2*x+1}_{2*y}",
-                f"{int(z)+1}/{2*x+1}_{2*y+1}",
-            ]
-            for child, child_id in zip(qtree.children, child_ids):
+            for child, child_id in zip(qtree.children, child_tile_ids(tile_id)):
                 self.recurse(child, child_id)
                 if child_id in self.metadata:
                     if child_id in self.metadata:
                         self.metadata[tile_id]["children"].append(
                             self.metadata[child_id]
                         )
+
+
+def flatten_tiles(root):
+    """tile id -> metadata entry for every entry under root, sharing the dicts"""
+    tiles = {}
+    stack = [root]
+    while stack:
+        entry = stack.pop()
+        tiles[entry["tile_id"]] = entry
+        stack.extend(entry["children"])
+    return tiles
+
+
+def walk_metadata(metadata, tile_id="0/0_0"):
+    """Tile ids in the same order as walk_tiles, from the metadata tree."""
+    yield tile_id
+    for child in metadata[tile_id]["children"]:
+        yield from walk_metadata(metadata, child["tile_id"])
+
+
+class TileRefresher:
+    """
+    Folds changed rows into a published projection without rebuilding it.
+
+    Tile contents come from the tile order the full run kept in state_dir and
+    the tree from its metadata. A changed row first leaves the tile holding
+    its old version, then goes down the tree to the leaf covering its new
+    position (or a new leaf, where the quadrant used to be empty). Leaves
+    that overflow are split with the same QuadTree as a full build. Only the
+    tiles whose rows changed are re-encoded.
+
+    Rows never move into interior tiles, so their level-of-detail samples
+    drift slowly as the table grows; a full run rebalances them.
+    """
+
+    def __init__(self, state_dir: str, metadata: dict):
+        import os, json, pyarrow as pa
+
+        self.state_dir = state_dir
+        self.metadata = metadata  # flat, as TileUploader builds it
+
+        tile_order_dir = os.path.join(state_dir, "tile_order")
+        source = pa.memory_map(os.path.join(tile_order_dir, "tiles.arrow"))
+        self.tile_order = pa.ipc.open_file(source).read_all()
+        with open(os.path.join(tile_order_dir, "offsets.json")) as f:
+            self.tile_offsets = json.load(f)
+
+        self.changed = {}  # tile id -> new table
+        self.num_rows = len(self.tile_order)
+
+    def load_delta(self, delta_dir, xy_path, vector_col, primary_key_col):
+        """The changed rows fetched into delta_dir, shaped like the tiles."""
+        from quadtree import PointColumns
+
+        xy = PointColumns.from_arrow(xy_path)
+        encoder = TileEncoder(
+            delta_dir, self.tile_order.schema, vector_col, primary_key_col
+        )
+        return encoder.gather_tile(xy.x, xy.y, xy.row_index)
+
+    def tile_table(self, tile_id):
+        if tile_id in self.changed:
+            return self.changed[tile_id]
+        offset, length = self.tile_offsets.get(tile_id, (0, 0))
+        return self.tile_order.slice(offset, length)
+
+    def apply(self, delta):
+        """delta: the changed rows, already shaped like the tiles (x, y, ix, user_*)"""
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        # drop the old versions of updated rows from whichever tile has them
+        stale = pc.is_in(self.tile_order.column("ix"), value_set=delta.column("ix"))
+        stale_rows = np.flatnonzero(stale.to_numpy(zero_copy_only=False))
+        self.num_rows += len(delta) - len(stale_rows)
+        tile_ids = list(self.tile_offsets)
+        starts = np.array([self.tile_offsets[t][0] for t in tile_ids])
+        removed = {}
+        for row, tile in zip(
+            stale_rows, np.searchsorted(starts, stale_rows, side="right") - 1
+        ):
+            removed.setdefault(tile_ids[tile], []).append(row)
+
+        added = {}
+        xs = delta.column("x").to_numpy()
+        ys = delta.column("y").to_numpy()
+        self._assign("0/0_0", np.arange(len(delta)), xs, ys, added)
+
+        for tile_id in removed.keys() | added.keys():
+            table = self.tile_table(tile_id)
+            if tile_id in removed:
+                offset = self.tile_offsets[tile_id][0]
+                keep = np.ones(len(table), dtype=bool)
+                keep[np.array(removed[tile_id]) - offset] = False
+                table = table.filter(pa.array(keep))
+            if tile_id in added:
+                table = pa.concat_tables([table, delta.take(added[tile_id])])
+            self._set_tile(tile_id, table)
+
+    def _assign(self, tile_id, rows, xs, ys, added):
+        """Send rows down the tree from tile_id to the leaves covering them."""
+        import numpy as np
+
+        entry = self.metadata[tile_id]
+        if not entry["children"]:
+            added[tile_id] = np.concatenate([added.get(tile_id, []), rows]).astype(
+                np.int64
+            )
+            return
+
+        z, coords = tile_id.split("/", 1)
+        x, y = map(int, coords.split("_"))
+        size = 50 / 2 ** int(z)
+        right = xs[rows] > (2 * x + 1) * size  # same sides as quadrant_masks
+        below = ys[rows] > (2 * y + 1) * size
+        for child_id, (dx, dy) in zip(
+            child_tile_ids(tile_id), [(0, 0), (0, 1), (1, 0), (1, 1)]
+        ):
+            child_rows = rows[(right == dx) & (below == dy)]
+            if not len(child_rows):
+                continue
+            if child_id not in self.metadata:  # this quadrant was empty
+                self._add_entry(child_id, tile_id)
+            self._assign(child_id, child_rows, xs, ys, added)
+
+    def _add_entry(self, tile_id, parent_id):
+        entry = {
+            "tile_id": tile_id,
+            "uncompressed_size": 0,
+            "compressed_size": 0,
+            "children": [],
+            "node_count": 0,
+        }
+        self.metadata[tile_id] = entry
+        siblings = self.metadata[parent_id]["children"]
+        siblings.append(entry)
+        order = child_tile_ids(parent_id)
+        siblings.sort(key=lambda child: order.index(child["tile_id"]))
+
+    def _set_tile(self, tile_id, table):
+        import numpy as np
+        from quadtree import PointColumns, QuadTree
+
+        entry = self.metadata[tile_id]
+        if entry["children"] or len(table) <= QuadTree.MAX_TILE_POINTS:
+            self.changed[tile_id] = table
+            entry["node_count"] = len(table)
+            return
+
+        # an overflowing leaf becomes a subtree, built like any other
+        z, coords = tile_id.split("/", 1)
+        x, y = map(int, coords.split("_"))
+        size = 50 / 2 ** int(z)
+        points = PointColumns(
+            table.column("x").to_numpy(),
+            table.column("y").to_numpy(),
+            np.arange(len(table)),
+        )
+        subtree = QuadTree(
+            (2 * x + 1) * size, (2 * y + 1) * size, size, points, depth=int(z)
+        )
+        for node_id, node in walk_tiles(subtree, tile_id):
+            if node_id != tile_id:
+                z, coords = node_id.split("/", 1)
+                x, y = map(int, coords.split("_"))
+                self._add_entry(node_id, f"{int(z) - 1}/{x // 2}_{y // 2}")
+            self.changed[node_id] = table.take(node.node_columns()[2])
+            self.metadata[node_id]["node_count"] = len(node.nodes)
+
+    def upload(self, uploads: UploadPipeline, projection_id):
+        """Encode and queue every changed tile, filling in its sizes."""
+        for tile_id, table in self.changed.items():
+            data, uncompressed_size = encode_tile(table)
+            uploads.submit(tile_path(projection_id, tile_id), data)
+            self.metadata[tile_id]["uncompressed_size"] = uncompressed_size
+            self.metadata[tile_id]["compressed_size"] = len(data)
+
+    def write_tile_order(self, out_dir, chunk_rows=1 << 20):
+        """Write the refreshed tiles.arrow and offsets.json for the next refresh."""
+        import os, json, pyarrow as pa
+
+        os.makedirs(out_dir, exist_ok=True)
+        offsets, buffered, buffered_rows, written = {}, [], 0, 0
+        with pa.ipc.new_file(
+            os.path.join(out_dir, "tiles.arrow"), self.tile_order.schema
+        ) as writer:
+            for tile_id in walk_metadata(self.metadata):
+                table = self.tile_table(tile_id)
+                offsets[tile_id] = [written + buffered_rows, len(table)]
+                buffered.append(table)
+                buffered_rows += len(table)
+                if buffered_rows >= chunk_rows:
+                    writer.write_table(pa.concat_tables(buffered))
+                    written += buffered_rows
+                    buffered, buffered_rows = [], 0
+            if buffered:
+                writer.write_table(pa.concat_tables(buffered))
+
+        with open(os.path.join(out_dir, "offsets.json"), "w") as f:
+            json.dump(offsets, f)
@@ -1,12 +1,34 @@
-def finalize_projection(metadata, digest_by_col, projection_id, supabase, num_rows):
-    """finish metadata creation, upload metadata to supabase, update supabase projection status"""
-    import json
+def tile_path(projection_id, tile_id):
+    # an uncompressed arrow file inside one zstd frame
+    return f"{projection_id}/tiles/{tile_id}.arrow.zst"
 
-    color_stats = {}
 
-    for col, digest in digest_by_col.items():
-        cuts = [digest.percentile(p) for p in range(0, 101, 10)]
-        color_stats[col] = {"buckets": cuts}
+def encode_tile(table):
+    """
+    Serialize a tile to a zstd compressed arrow file in memory, returning
+    (bytes, uncompressed_size).
+    """
+    import io
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import zstandard as zstd
+
+    # one batch per tile; a slice of tiles.arrow can straddle its batches
+    table = table.combine_chunks()
+
+    # the arrow writer streams straight into the compressor
+    out = io.BytesIO()
+    compressor = zstd.ZstdCompressor().stream_writer(out, closefd=False)
+    sink = pa.PythonFile(compressor, mode="w")
+    feather.write_feather(table, sink, compression="uncompressed")
+    uncompressed_size = sink.tell()
+    compressor.close()
+    return out.getvalue(), uncompressed_size
+
+
+def finalize_projection(metadata, color_stats, projection_id, supabase, num_rows, sink):
+    """finish metadata creation, upload metadata to supabase, update supabase projection status"""
+    import json
 
     final_metadata = {
         "extent": {
@@ -16,22 +38,22 @@ def finalize_projection(metadata, digest_by_col, projection_id, supabase, num_ro
         "colorStats": color_stats,
     }
 
-    path = "/tmp/tiles/metadata.json"
-    with open(path, "w") as f:
-        json.dump(final_metadata, f, indent=2)
+    sink.put(
+        f"{projection_id}/metadata.json",
+        json.dumps(final_metadata, indent=2).encode(),
+    )
 
-    upload_to_r2(path, f"{projection_id}/metadata.json")
-    
     supabase.table("projections").update(
         {"status": "live", "number_points": num_rows}
     ).eq("projection_id", projection_id).execute()
 
-def make_arrow_schema(run_dir: str, vector_col: str, primary_key_col: str):
+
+def make_arrow_schema(shard_dir: str, vector_col: str, primary_key_col: str):
     import glob, pyarrow.dataset as ds, pyarrow as pa, os
 
     files = [
         f
-        for f in glob.glob(os.path.join(run_dir, "*.arrow"))
+        for f in glob.glob(os.path.join(shard_dir, "*.arrow"))
         if not f.endswith("xy.arrow")
     ]
     ds_obj = ds.dataset(files, format="arrow")
@@ -62,27 +84,11 @@ def make_arrow_schema(run_dir: str, vector_col: str, primary_key_col: str):
     return pa.schema(fields)
 
 
-def get_timestamp_cols(arrow_schema):
-    import pyarrow as pa
-
-    timestamp_columns = []
-
-    for field in arrow_schema:
-        name = field.name
-        if name in ("x", "y", "ix"):
-            continue
-
-        if pa.types.is_timestamp(field.type):
-            timestamp_columns.append(name)
-
-    return timestamp_columns
-
-
-def get_digest_by_col(arrow_schema):
+def get_stat_cols(arrow_schema):
+    """tile columns that get continuous color buckets"""
     import pyarrow as pa
-    from tdigest import TDigest
 
-    digest_by_column = {}
+    stat_cols = []
 
     for field in arrow_schema:
         name = field.name
@@ -94,32 +100,85 @@ def get_digest_by_col(arrow_schema):
             or pa.types.is_floating(field.type)
             or pa.types.is_timestamp(field.type)
         ):
-            digest_by_column[name] = TDigest()
+            stat_cols.append(name)
 
-    return digest_by_column
+    return stat_cols
 
 
-def upload_to_r2(local_path, remote_path, bucket="quadtree-tiles"):
-    import boto3
-    import os
+def compute_color_stats(dataset, arrow_schema):
+    """exact deciles of every stat column, read one column at a time from the shards"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
 
-    account_id = os.environ["CLOUDFLARE_ACCOUNT_ID"]
-    api_key = os.environ["CLOUDFLARE_API_KEY"]
-    api_secret = os.environ["CLOUDFLARE_API_SECRET"]
+    color_stats = {}
 
-    r2 = boto3.client(
-        "s3",
-        endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
-        aws_access_key_id=api_key,
-        aws_secret_access_key=api_secret,
-        region_name="auto",
-    )
+    for col in get_stat_cols(arrow_schema):
+        values = dataset.to_table(columns=[col.removeprefix("user_")]).column(0)
+        values = values.drop_null()
+        if not len(values):
+            continue
 
-    for attempt in range(4):
-        try:
-            r2.upload_file(local_path, bucket, remote_path)
-            break
-        except Exception as e:
-            print("failed to upload to supabase", e)
-            if attempt == 3:
-                raise e
+        if pa.types.is_timestamp(values.type):
+            # epoch ms, same units as the tile column
+            values = pc.divide(
+                values.cast(pa.timestamp("us", tz=values.type.tz)).cast(pa.int64()),
+                1000.0,
+            )
+        else:
+            values = values.cast(pa.float64())
+
+        cuts = pc.quantile(values, q=[p / 100 for p in range(0, 101, 10)])
+        color_stats[col] = {"buckets": cuts.to_pylist()}
+
+    return color_stats
+
+
+class R2Sink:
+    """
+    Puts objects in the tiles bucket. boto3 clients are thread safe, so one
+    client (and its connection pool) is shared by every upload thread.
+    """
+
+    def __init__(self, bucket="quadtree-tiles", max_connections=32, endpoint_url=None):
+        import boto3
+        import os
+        from botocore.config import Config
+
+        if endpoint_url is None:  # anything s3 compatible works, e.g. a local minio
+            account_id = os.environ["CLOUDFLARE_ACCOUNT_ID"]
+            endpoint_url = f"https://{account_id}.r2.cloudflarestorage.com"
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=os.environ["CLOUDFLARE_API_KEY"],
+            aws_secret_access_key=os.environ["CLOUDFLARE_API_SECRET"],
+            region_name="auto",
+            config=Config(max_pool_connections=max_connections),
+        )
+
+    def put(self, remote_path, data: bytes):
+        for attempt in range(4):
+            try:
+                self.client.put_object(Bucket=self.bucket, Key=remote_path, Body=data)
+                break
+            except Exception as e:
+                print("failed to upload to r2", e)
+                if attempt == 3:
+                    raise e
+
+
+class LocalSink:
+    """Writes objects under a directory instead of the bucket, for dry runs."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, remote_path, data: bytes):
+        import os
+
+        path = os.path.join(self.root, remote_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
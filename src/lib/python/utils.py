@@ -1,6 +1,6 @@
 def check_and_update_usage(
     num_shards: int,
-    run_dir: str,
+    shard_dir: str,
     remaining_rows: int,
     database_id: str,
     total_rows_estimate_int: int,
@@ -20,7 +20,7 @@ def check_and_update_usage(
         True
     ):  # we wait to make sure all shards' updates have been committed--can't commit in each shard due to volume concurrent writer limit
         vol.reload()
-        arrow_files = glob.glob(os.path.join(run_dir, "*.arrow"))
+        arrow_files = glob.glob(os.path.join(shard_dir, "*.arrow"))
         if len(arrow_files) == num_shards:
             break
         if waited >= MAX_WAIT:
@@ -31,7 +31,7 @@ def check_and_update_usage(
         time.sleep(step)
         waited += step
 
-    ds_obj = ds.dataset(run_dir, format="arrow")
+    ds_obj = ds.dataset(shard_dir, format="arrow")
     num_rows = ds_obj.count_rows()
 
     db_res = (
@@ -60,29 +60,127 @@ def check_and_update_usage(
         raise RuntimeError(f"Usage limit exceeded: cancelling reduce.")
 
 
-def get_num_shards(total_rows: int, creds) -> int:
-    import math
+# what one shard's COPY stream moves through the arrow decoder
+SHARD_BYTES_PER_SECOND = 25e6
+MAX_SHARDS = 1000
+MAX_FETCH_CONCURRENCY = 80
+# every hashed shard scans the whole table, so those keep the old cap
+MAX_HASHED_SHARDS = 80
 
-    if total_rows < 100_000:
-        rows_per_shard = 5_000
-    elif total_rows < 400_000:
-        rows_per_shard = 10_000
-    elif total_rows < 1_000_000:
-        rows_per_shard = 15_000
-    elif total_rows < 5_000_000:
-        rows_per_shard = 35_000
-    else:
-        rows_per_shard = 60_000
 
-    hard_cap = 80
+def plan_fetch(
+    creds,
+    schema: str,
+    table: str,
+    vector_col: str,
+    total_rows: int,  # the caller's estimate, used when postgres has no stats
+    target_shard_seconds: float = 30,
+    columns: list[str] | None = None,  # as for select_columns
+    truncate: dict[str, int] | None = None,
+    halfvec: bool = False,
+    primary_key_col: str | None = None,  # fetched along with any allow-list
+) -> dict:
+    """
+    Size the fetch from the table's statistics instead of its row count, so
+    wide rows get small shards and narrow rows big ones.
+
+    Rows come from reltuples scaled to the table's current page count (the
+    same estimate postgres' own planner makes), row width from pg_stats
+    avg_width, with the vector column sized from its declared dimensions.
+    Shards are cut to take about target_shard_seconds each; how many run at
+    once is bounded by the free connection slots. Only selected columns
+    count, truncated ones at most their truncated length.
+    """
+    import math, psycopg
 
-    free_slots = _free_connection_slots(creds, reserve=5)
+    with psycopg.connect(**creds, prepare_threshold=None) as pg:
+        with pg.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.reltuples, c.relpages,
+                       pg_relation_size(c.oid) / current_setting('block_size')::int,
+                       pg_table_size(c.oid)
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s AND c.relname = %s
+            """,
+                (schema, table),
+            )
+            reltuples, relpages, num_blocks, table_bytes = cur.fetchone()
+
+            cur.execute(
+                """
+                SELECT a.attname, t.typname, a.atttypmod, t.typlen, s.avg_width
+                FROM pg_attribute a
+                JOIN pg_type t ON t.oid = a.atttypid
+                LEFT JOIN pg_stats s
+                    ON s.schemaname = %s AND s.tablename = %s AND s.attname = a.attname
+                WHERE a.attrelid = format('%%I.%%I', %s::text, %s::text)::regclass
+                    AND a.attnum > 0 AND NOT a.attisdropped
+            """,
+                (schema, table, schema, table),
+            )
+            table_columns = cur.fetchall()
+
+    if reltuples > 0 and relpages > 0:
+        rows = reltuples / relpages * max(num_blocks, 1)
+    else:  # never analyzed (reltuples is -1 or 0)
+        rows = total_rows
+
+    truncate = truncate or {}
+    keep = None if columns is None else {*columns, vector_col, primary_key_col}
+    row_bytes = 2  # COPY binary: field count per row
+    for name, typname, typmod, typlen, avg_width in table_columns:
+        if keep is not None and name not in keep:
+            continue
+        row_bytes += 4  # and a length per field
+        if name in truncate:
+            row_bytes += min(avg_width or truncate[name], truncate[name])
+        elif name == vector_col and typname in ("vector", "halfvec") and typmod > 0:
+            row_bytes += 4 + typmod * (2 if typname == "halfvec" or halfvec else 4)
+        elif avg_width is not None:
+            row_bytes += avg_width
+        else:
+            row_bytes += typlen if typlen > 0 else 32
+
+    # avg_width counts values moved out to TOAST by their pointer, so the size
+    # on disk (which includes TOAST) bounds wide text columns from below, as
+    # long as every column is fetched whole
+    total_bytes = rows * row_bytes
+    if columns is None and not truncate and not halfvec:
+        total_bytes = max(total_bytes, table_bytes)
+
+    shard_bytes = SHARD_BYTES_PER_SECOND * target_shard_seconds
+    num_shards = max(1, min(MAX_SHARDS, math.ceil(total_bytes / shard_bytes)))
+    concurrency = min(
+        num_shards, MAX_FETCH_CONCURRENCY, _free_connection_slots(creds, reserve=5)
+    )
+    eta = total_bytes / (SHARD_BYTES_PER_SECOND * concurrency)
 
-    return min(
-        math.ceil(total_rows / rows_per_shard),
-        hard_cap,
-        free_slots,
+    print(
+        f"planned fetch: ~{rows:,.0f} rows x {row_bytes:,.0f} B = "
+        f"{total_bytes / 1e9:.2f} GB in {num_shards} shards, "
+        f"{concurrency} at a time, ETA ~{eta / 60:.1f} min"
     )
+    return {
+        "num_shards": num_shards,
+        "concurrency": concurrency,
+        "rows": rows,
+        "bytes": total_bytes,
+        "eta_seconds": eta,
+    }
+
+
+def split_connections(budget: int, per_container: int) -> tuple[int, int]:
+    """
+    (containers, connections each) to fetch over at most `budget` connections
+    in total, with no container holding more than per_container. The free
+    slots are only counted once, so every container's share comes out of it.
+    """
+    import math
+
+    containers = max(1, math.ceil(budget / per_container))
+    return containers, max(1, budget // containers)
 
 
 def _free_connection_slots(creds, reserve=5):
@@ -100,6 +198,255 @@ def _free_connection_slots(creds, reserve=5):
     return max(1, max_conn - in_use - reserve)
 
 
+def plan_shards(
+    creds,
+    schema: str,
+    table: str,
+    primary_key_col: str,
+    num_shards: int,
+    allow_ctid: bool = True,  # only if every shard reads one SharedSnapshot
+) -> list[tuple[str, list]]:
+    """
+    Split the table into at most num_shards disjoint slices so every shard only
+    reads its own part of the table instead of scanning (and hashing) all of it.
+
+    Returns one (where_sql, params) pair per shard. Prefers ctid block ranges,
+    which postgres (14+) serves with a TID range scan, then primary key ranges
+    taken from the pg_stats histogram, and only falls back to hashing the
+    primary key when neither is available. Each hashed shard is a full scan,
+    so there are at most MAX_HASHED_SHARDS of them.
+
+    A non-HOT UPDATE moves a row to another block, so ctid shards reading in
+    snapshots of their own could see it twice or not at all; they are only
+    planned with allow_ctid, when the shards share one snapshot.
+    """
+    import psycopg
+
+    if num_shards <= 1:
+        return [("TRUE", [])]
+
+    with psycopg.connect(**creds, prepare_threshold=None) as pg:
+        with pg.cursor() as cur:
+            cur.execute("SHOW server_version_num")
+            server_version = int(cur.fetchone()[0])
+
+            cur.execute(
+                """
+                SELECT c.relkind,
+                       pg_relation_size(c.oid) / current_setting('block_size')::int
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s AND c.relname = %s
+            """,
+                (schema, table),
+            )
+            relkind, num_blocks = cur.fetchone()
+
+            cur.execute(
+                """
+                SELECT format_type(a.atttypid, a.atttypmod),
+                       s.histogram_bounds::text::text[]
+                FROM pg_attribute a
+                LEFT JOIN pg_stats s
+                    ON s.schemaname = %s AND s.tablename = %s AND s.attname = a.attname
+                WHERE a.attrelid = format('%%I.%%I', %s::text, %s::text)::regclass
+                    AND a.attname = %s
+            """,
+                (schema, table, schema, table, primary_key_col),
+            )
+            pk_type, bounds = cur.fetchone()
+
+    if (
+        allow_ctid
+        and relkind == "r"
+        and server_version >= 140000
+        and num_blocks >= num_shards
+    ):
+        print(f"planning {num_shards} ctid shards over {num_blocks} blocks")
+        return _ctid_ranges(num_blocks, num_shards)
+
+    if bounds and len(bounds) > 2:
+        print(f"planning primary key shards from {len(bounds)} histogram bounds")
+        return _pk_ranges(primary_key_col, pk_type, bounds, num_shards)
+
+    num_shards = min(num_shards, MAX_HASHED_SHARDS)
+    print(f"no ctid or histogram info, falling back to {num_shards} hashed shards")
+    return [
+        (f"mod(abs(hashtext(({primary_key_col})::text)), %s) = %s", [num_shards, i])
+        for i in range(num_shards)
+    ]
+
+
+def _ctid_ranges(num_blocks: int, num_shards: int) -> list[tuple[str, list]]:
+    starts = [num_blocks * i // num_shards for i in range(num_shards)]
+    plan = []
+    for i, start in enumerate(starts):
+        if i == len(starts) - 1:  # open ended so rows appended after planning are kept
+            plan.append(("ctid >= %s::tid", [f"({start},0)"]))
+        else:
+            plan.append(
+                (
+                    "ctid >= %s::tid AND ctid < %s::tid",
+                    [f"({start},0)", f"({starts[i + 1]},0)"],
+                )
+            )
+    return plan
+
+
+def _pk_ranges(
+    primary_key_col: str, pk_type: str, bounds: list[str], num_shards: int
+) -> list[tuple[str, list]]:
+    cuts = []
+    for i in range(1, num_shards):
+        cut = bounds[round(i * (len(bounds) - 1) / num_shards)]
+        if not cuts or cut != cuts[-1]:
+            cuts.append(cut)
+
+    lower = f"({primary_key_col}) >= CAST(%s AS {pk_type})"
+    upper = f"({primary_key_col}) < CAST(%s AS {pk_type})"
+    plan = [(upper, [cuts[0]])]
+    for lo, hi in zip(cuts, cuts[1:]):
+        plan.append((f"{lower} AND {upper}", [lo, hi]))
+    plan.append((lower, [cuts[-1]]))
+    return plan
+
+
+class SharedSnapshot:
+    """
+    Keeps a repeatable read transaction open and exports its snapshot, so the
+    COPY of every shard can read the table as of the same moment (SET
+    TRANSACTION SNAPSHOT) as long as the block is open. id is None when the
+    export fails, e.g. on a connection pooler that won't hold the session.
+    """
+
+    def __init__(self, creds):
+        self.creds = creds
+        self.pg = None
+        self.id = None
+
+    def __enter__(self):
+        import psycopg
+
+        try:
+            self.pg = psycopg.connect(
+                **self.creds, prepare_threshold=None, autocommit=True
+            )
+            self.pg.execute("SET idle_in_transaction_session_timeout = 0")
+            self.pg.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+            (self.id,) = self.pg.execute("SELECT pg_export_snapshot()").fetchone()
+            print(f"exported snapshot {self.id}")
+        except psycopg.Error as e:
+            print("couldn't export a snapshot, shards read their own:", e)
+            self.__exit__()
+        return self
+
+    def __exit__(self, *exc):
+        if self.pg is not None:
+            self.pg.close()  # ends the transaction, and with it the snapshot
+            self.pg = None
+
+
+def is_pool_limit(error: Exception) -> bool:
+    """True when postgres refused a connection because it has none left."""
+    msg = str(error).lower()
+    return (
+        "max client connections" in msg
+        or "too many clients already" in msg
+        or "remaining connection slots are reserved" in msg
+        or "couldn't get a connection" in msg  # psycopg_pool timed out connecting
+    )
+
+
+class AdaptiveFetcher:
+    """
+    Runs fetch(item) -> (rows, seconds) for every item (a shard, or a batch
+    of shards), keeping a sliding window of calls in flight and handing the
+    next item from a queue to whichever slot frees up first.
+
+    The window is set AIMD style: it doubles every window of successes until
+    the first connection error (slow start), then grows by one per window
+    while each fetch still moves at least `slowdown` of the best rows/s
+    seen, and shrinks by one per window when they get slower. A pool-limit
+    error halves it, at most once per window, and puts the item back on
+    the queue.
+    """
+
+    def __init__(self, fetch, max_concurrency, initial_concurrency=4, slowdown=0.7):
+        self.fetch = fetch
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(min(initial_concurrency, self.max_concurrency))
+        self.slowdown = slowdown
+        self.slow_start = True
+        self.best_rate = 0.0  # rows/s of the fastest fetch so far
+        self.last_cut = float("-inf")
+        self.rows = 0
+        self.retries = 0
+
+    def run(self, items):
+        import time
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+        queue = deque(items)
+        in_flight = {}  # future -> (item, start time)
+        t0 = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while queue or in_flight:
+                while queue and len(in_flight) < int(self.limit):
+                    item = queue.popleft()
+                    future = pool.submit(self.fetch, item)
+                    in_flight[future] = (item, time.monotonic())
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item, started = in_flight.pop(future)
+                    try:
+                        rows, seconds = future.result()
+                    except Exception as e:
+                        if not is_pool_limit(e):
+                            print(f"‼️ fetch {item} raised an unretryable error: {e!r}")
+                            raise
+                        print(f"→ fetch {item} will be retried (pool limit hit)")
+                        queue.appendleft(item)
+                        self.retries += 1
+                        self._on_pool_limit(started)
+                        if not in_flight and self.limit <= 1:
+                            time.sleep(5)  # other clients hold every slot
+                        continue
+                    self._on_success(rows, seconds)
+
+        elapsed = time.monotonic() - t0
+        print(
+            f"✅  {len(items)} fetches, {self.rows} rows in {elapsed:.1f}s "
+            f"({self.retries} retries, final window {int(self.limit)})"
+        )
+
+    def _on_pool_limit(self, started):
+        import time
+
+        # calls started before the last cut saw the old window; don't cut twice
+        if started < self.last_cut:
+            return
+        self.slow_start = False
+        self.limit = max(1.0, self.limit / 2)
+        self.last_cut = time.monotonic()
+        print(f"↩︎  pool limit hit, window now {int(self.limit)}")
+
+    def _on_success(self, rows, seconds):
+        self.rows += rows
+        rate = rows / max(seconds, 1e-3)
+        self.best_rate = max(self.best_rate, rate)
+
+        if rate < self.slowdown * self.best_rate:  # postgres is saturated
+            self.slow_start = False
+            self.limit = max(1.0, self.limit - 1 / self.limit)
+        elif self.slow_start:
+            self.limit = min(self.max_concurrency, self.limit + 1)
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+
 def get_creds(database_id: str):
     from supabase import create_client
     import os
@@ -124,18 +471,313 @@ def get_creds(database_id: str):
     return creds
 
 
-def _flush(buf, col_names, writer, sink):
+def table_fingerprint(creds, schema: str, table: str):
+    """
+    Something that changes whenever the table's rows might have: its file
+    node (rewritten by TRUNCATE, VACUUM FULL, CLUSTER), its size and the
+    cumulative insert/update/delete counters. None when the table can't be
+    fingerprinted (views, or track_counts off), so it is never cached.
+    """
+    import psycopg
+
+    with psycopg.connect(**creds, prepare_threshold=None) as pg:
+        with pg.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.relkind, c.relfilenode, pg_relation_size(c.oid),
+                       s.n_tup_ins, s.n_tup_upd, s.n_tup_del,
+                       current_setting('track_counts')
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN pg_stat_all_tables s ON s.relid = c.oid
+                WHERE n.nspname = %s AND c.relname = %s
+            """,
+                (schema, table),
+            )
+            row = cur.fetchone()
+
+    if row is None:
+        return None
+    relkind, *counters, track_counts = row
+    if relkind != "r" or track_counts != "on" or None in counters:
+        return None
+    return counters
+
+
+def artifact_key(
+    creds,
+    schema: str,
+    table: str,
+    vector_col: str,
+    primary_key_col: str,
+    columns: list[str] | None = None,
+    truncate: dict[str, int] | None = None,
+    halfvec: bool = False,
+) -> str | None:
+    """Content address of a table snapshot's artifacts, None if it can't be cached."""
+    import hashlib, json
+
+    fingerprint = table_fingerprint(creds, schema, table)
+    if fingerprint is None:
+        return None
+    parts = [
+        creds["host"],
+        creds["port"],
+        creds["dbname"],
+        schema,
+        table,
+        vector_col,
+        primary_key_col,
+        fingerprint,
+    ]
+    if columns is not None or truncate:  # shards hold only the selection
+        parts.append([sorted(columns) if columns is not None else None, truncate])
+    if halfvec:
+        parts.append("halfvec")
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+
+
+def read_manifest(artifact_dir: str) -> dict | None:
+    import json, os
+
+    try:
+        with open(os.path.join(artifact_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_manifest(artifact_dir: str, manifest: dict):
+    """Replace the manifest in one rename, stamping last_used."""
+    import json, os, time
+
+    manifest = {**manifest, "last_used": time.time()}
+    os.makedirs(artifact_dir, exist_ok=True)
+    tmp = os.path.join(artifact_dir, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(artifact_dir, "manifest.json"))
+    return manifest
+
+
+def lease_artifacts(artifact_dir: str, seconds: float) -> dict | None:
+    """
+    Stamp last_used and keep the entry from eviction for the next `seconds`,
+    for a stage that will be reading it for a while.
+    """
+    import time
+
+    manifest = read_manifest(artifact_dir)
+    if manifest is None:
+        return None
+    leased_until = max(manifest.get("leased_until", 0), time.time() + seconds)
+    return write_manifest(artifact_dir, {**manifest, "leased_until": leased_until})
+
+
+def publish_shards(fetched_dir: str, artifact_dir: str) -> str:
+    """
+    Move a finished fetch into its cache entry in one rename, so runs on the
+    same snapshot never write into or delete each other's shards. When the
+    entry already has shards (another run published first) this run keeps
+    reading its own. Returns the directory to read the shards from.
+    """
+    import os
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    shard_dir = os.path.join(artifact_dir, "shards")
+    try:
+        os.rename(fetched_dir, shard_dir)
+    except OSError:
+        return fetched_dir
+    return shard_dir
+
+
+def evict_artifacts(
+    artifacts_root: str,
+    ttl: float,
+    max_bytes: int,
+    min_age: float = 60 * 60,  # never evict anything used this recently
+) -> list[str]:
+    """
+    Delete cache entries not used for ttl seconds, then the least recently
+    used ones until the cache fits in max_bytes. Leased entries are skipped.
+    Returns the evicted keys.
+    """
+    import os, shutil, time
+
+    if not os.path.isdir(artifacts_root):
+        return []
+
+    def size_of(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+
+    now = time.time()
+    entries = []  # (last_used, key, bytes, leased_until)
+    for key in os.listdir(artifacts_root):
+        path = os.path.join(artifacts_root, key)
+        manifest = read_manifest(path) or {}
+        last_used = manifest.get("last_used", os.path.getmtime(path))
+        leased_until = manifest.get("leased_until", 0)
+        entries.append((last_used, key, size_of(path), leased_until))
+    entries.sort()
+
+    total = sum(size for _, _, size, _ in entries)
+    evicted = []
+    for last_used, key, size, leased_until in entries:
+        age = now - last_used
+        if age < min_age:
+            break  # sorted, so everything after is newer still
+        if age < ttl and total <= max_bytes:
+            break
+        if leased_until > now:
+            continue
+        shutil.rmtree(os.path.join(artifacts_root, key), ignore_errors=True)
+        total -= size
+        evicted.append(key)
+    return evicted
+
+
+def read_refresh_state(state_dir: str) -> dict:
+    import json, os
+
+    with open(os.path.join(state_dir, "state.json")) as f:
+        return json.load(f)
+
+
+def update_refresh_state(state_dir: str, **fields) -> dict:
+    """Merge fields into state.json, everything incremental refresh needs to know."""
+    import json, os
+
+    try:
+        state = read_refresh_state(state_dir)
+    except FileNotFoundError:
+        state = {}
+    state.update(fields)
+    os.makedirs(state_dir, exist_ok=True)
+    tmp = os.path.join(state_dir, "state.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, default=float)  # pmin/pmax are numpy floats
+    os.replace(tmp, os.path.join(state_dir, "state.json"))
+    return state
+
+
+def current_watermark(creds, schema: str, table: str, refresh_col: str):
+    """
+    Position to fetch changes after, taken *before* a fetch so rows written
+    while it runs are picked up by the next refresh (possibly twice, which is
+    harmless since rows are replaced by primary key).
+
+    refresh_col "xmin" uses the oldest transaction still running, so it
+    can't miss a change. Anything else is a column that grows on every
+    insert/update, like updated_at, and only sees what is committed: a
+    transaction in flight now that commits later with a value below the
+    watermark (updated_at is usually its start time) is never picked up.
+    Use "xmin" where that matters.
+    """
+    import psycopg
+
+    with psycopg.connect(**creds, prepare_threshold=None) as pg:
+        with pg.cursor() as cur:
+            if refresh_col == "xmin":
+                cur.execute(
+                    "SELECT txid_snapshot_xmin(txid_current_snapshot()) % 4294967296"
+                )
+            else:
+                cur.execute(f"SELECT max({refresh_col})::text FROM {schema}.{table}")
+            (watermark,) = cur.fetchone()
+    return watermark
+
+
+def changed_rows_plan(refresh_col: str, watermark) -> list[tuple[str, list]]:
+    """A one-shard plan for fetch_table_helper selecting rows changed after watermark."""
+    if watermark is None:  # the table was empty
+        return [("TRUE", [])]
+    if refresh_col == "xmin":
+        # xids wrap, so compare how long ago they were rather than their values
+        return [("age(xmin) <= age(%s::text::xid)", [str(watermark)])]
+    return [(f"({refresh_col}) > %s", [watermark])]
+
+
+def place_rows_helper(
+    vector_col: str, state_dir: str, batch_rows: int = 100_000
+) -> int:
+    """
+    Project the fetched changed rows in <state_dir>/delta with the reducers
+    saved by the full run and write <state_dir>/delta_xy.arrow, normalized
+    with the full run's percentiles. Returns the number of rows placed.
+    """
+    import pyarrow as pa, pyarrow.dataset as ds, pyarrow.ipc as ipc
+    import numpy as np, os, tempfile
+    import multiprocessing as mp
+    from reducers import run_transform
+
+    state = read_refresh_state(state_dir)
+    dataset = ds.dataset(os.path.join(state_dir, "delta"), format="arrow")
+    num_rows = dataset.count_rows()
+    if num_rows == 0:
+        return 0
+    dim = len(dataset.take([0])[vector_col][0])
+
+    tmp = tempfile.NamedTemporaryFile(prefix="vectors_", suffix=".mmp", delete=False)
+    mmap_path = tmp.name
+    tmp.close()
+    mmap = np.memmap(mmap_path, dtype=np.float32, mode="w+", shape=(num_rows, dim))
+    out = 0
+    for batch in dataset.scanner(
+        columns=[vector_col], batch_size=batch_rows
+    ).to_batches():
+        vecs = batch.column(vector_col).flatten().to_numpy().reshape(-1, dim)
+        mmap[out : out + len(vecs)] = vecs
+        out += len(vecs)
+    mmap.flush()
+
+    tmp_out = tempfile.NamedTemporaryFile(suffix=".npy", delete=False)
+    tmp_out.close()
+    p = mp.get_context("spawn").Process(
+        target=run_transform,
+        args=(state_dir, mmap_path, (num_rows, dim), tmp_out.name, batch_rows),
+    )  # same as embed_to_2d_helper, keep the reducer out of this process
+    p.start()
+    p.join()
+    if p.exitcode != 0:
+        raise RuntimeError(f"transform subprocess exited with {p.exitcode}")
+
+    X_low = np.load(tmp_out.name)
+    os.unlink(tmp_out.name)
+    del mmap
+    os.unlink(mmap_path)
+
+    X_norm = normalize_xy(X_low, np.array(state["pmin"]), np.array(state["pmax"]))
+    table = pa.Table.from_arrays(
+        [
+            pa.array(X_norm[:, 0], type=pa.float32()),
+            pa.array(X_norm[:, 1], type=pa.float32()),
+            pa.array(np.arange(num_rows, dtype=np.int32)),
+        ],
+        names=["x", "y", "row-index"],
+    )
+    with pa.OSFile(os.path.join(state_dir, "delta_xy.arrow"), "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return num_rows
+
+
+def _flush(batch, schema, writer, sink):
     import pyarrow as pa, pyarrow.ipc as ipc
     import pyarrow.compute as pc
     import logging
 
-    rows = [dict(zip(col_names, vs)) for vs in zip(*buf.values())]
-    batch = pa.RecordBatch.from_pylist(rows)
-
     if writer is None:
-        writer = ipc.new_file(sink, batch.schema)
+        writer = ipc.new_file(sink, schema)
 
         logging.info("flushing batch with %s rows", batch.num_rows)
+    if batch.schema != schema:
+        # columns decoded by psycopg infer their type per batch
+        batch = pa.Table.from_batches([batch]).cast(schema).to_batches()[0]
 
     # -------- null-column check ---------- #
     for i, name in enumerate(batch.schema.names):
@@ -144,125 +786,258 @@ def _flush(buf, col_names, writer, sink):
             logging.warning("⚠︎ column %s became 100%% null in this batch", name)
     writer.write_batch(batch)
 
-    for k in buf:
-        buf[k].clear()
-
     return writer
 
 
+COLUMNS_SQL = """
+    SELECT column_name, udt_name, numeric_precision, numeric_scale
+    FROM information_schema.columns
+    WHERE table_schema=%s AND table_name=%s
+    ORDER BY ordinal_position
+"""
+
+
+def _quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def parse_column_selection(columns: str | None, truncate: str | None):
+    """
+    The endpoint's "a,b,c" column allow-list and "a:500,b:200" truncation
+    lengths -> (["a", "b", "c"], {"a": 500, "b": 200}).
+    None is every column / nothing truncated.
+    """
+    keep = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    lengths = {}
+    for item in (truncate or "").split(","):
+        if item.strip():
+            name, _, length = item.rpartition(":")
+            lengths[name.strip()] = int(length)
+    return keep, lengths or None
+
+
+def select_columns(
+    table_columns,
+    vector_col: str,
+    primary_key_col: str,
+    columns: list[str] | None = None,
+    truncate: dict[str, int] | None = None,
+    halfvec: bool = False,
+):
+    """
+    COPY select list for a column selection, and the information_schema rows
+    of what it returns, for CopyBinaryDecoder.
+
+    Only `columns` (plus the vector and primary key, always) leave the
+    database; a column in `truncate` is cut to that many characters by
+    postgres with left(), so arrives as text. With halfvec the vector column
+    is cast to pgvector's halfvec (pgvector >= 0.7), half the bytes of a
+    vector on the wire and in the shards.
+    """
+    truncate = truncate or {}
+    names = [c[0] for c in table_columns]
+    keep = set(names) if columns is None else {*columns, vector_col, primary_key_col}
+    unknown = (keep | set(truncate)) - set(names)
+    if unknown:
+        raise ValueError(f"no such columns in table: {sorted(unknown)}")
+    if {vector_col, primary_key_col} & set(truncate):
+        raise ValueError("the vector and primary key columns can't be truncated")
+
+    select, selected = [], []
+    for column in table_columns:
+        name = column[0]
+        if name not in keep:
+            continue
+        if name in truncate:
+            select.append(
+                f"left({_quote_ident(name)}::text, {int(truncate[name])}) "
+                f"AS {_quote_ident(name)}"
+            )
+            selected.append((name, "text", None, None))
+        elif name == vector_col and halfvec:
+            select.append(f"{_quote_ident(name)}::halfvec AS {_quote_ident(name)}")
+            selected.append((name, "halfvec", None, None))
+        else:
+            select.append(_quote_ident(name))
+            selected.append(column)
+    return ", ".join(select), selected
+
+
+def _copy_sql(schema: str, table: str, where_sql: str, select_sql: str = "*") -> str:
+    return f"""
+    COPY (
+        SELECT {select_sql}
+            FROM {schema}.{table}
+            WHERE {where_sql}
+    ) TO STDOUT (FORMAT BINARY)
+"""
+
+
+class _ShardWriter:
+    """Writes decoded batches to <shard_dir>/<shard_id>.arrow, renamed into place on close."""
+
+    def __init__(self, shard_dir: str, shard_id: int):
+        import pathlib, pyarrow as pa
+
+        self.dst = pathlib.Path(shard_dir) / f"{shard_id}.arrow"
+        self.dst.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp = self.dst.with_suffix(".tmp")
+        self.sink = pa.OSFile(str(self.tmp), "wb")
+        self.writer = None
+        self.arrow_schema = None
+        self.num_rows = 0
+
+    def write(self, batches):
+        for batch in batches:
+            self.arrow_schema = self.arrow_schema or batch.schema
+            self.writer = _flush(batch, self.arrow_schema, self.writer, self.sink)
+            self.num_rows += batch.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.sink.close()
+        self.tmp.rename(self.dst)
+
+
 def fetch_table_helper(
     shard_id: int,
     schema: str,
     table: str,
     vector_col: str,
     primary_key_col: str,
-    total_shards: int,
+    shard_plan: list[tuple[str, list]],
     creds,
-    run_dir: str,
+    shard_dir: str,
+    columns: list[str] | None = None,
+    truncate: dict[str, int] | None = None,
+    halfvec: bool = False,
 ):
-    import psycopg, pyarrow as pa, pyarrow.ipc as ipc, pathlib
-    from pgvector.psycopg import register_vector
-    import uuid
+    import psycopg
+    from copy_decoder import CopyBinaryDecoder
     import time
 
     pg = psycopg.connect(**creds)
     with pg.cursor() as cur:
         cur.execute("SET statement_timeout = 0")
-    register_vector(pg)
     with pg.cursor() as cur:
-        cur.execute(
-            """
-            SELECT column_name, udt_name
-            FROM information_schema.columns
-            WHERE table_schema=%s AND table_name=%s
-            ORDER BY ordinal_position
-        """,
-            (schema, table),
+        cur.execute(COLUMNS_SQL, (schema, table))
+        select_sql, selected = select_columns(
+            cur.fetchall(), vector_col, primary_key_col, columns, truncate, halfvec
         )
-        rows = cur.fetchall()
-        col_names, udt_names = zip(*rows)
 
-    dst = pathlib.Path(run_dir) / f"{shard_id}.arrow"
-    tmp = dst.with_suffix(".tmp")
-    sink = pa.OSFile(str(tmp), "wb")
-    writer = None
-    buf = {c: [] for c in col_names}
+    shard = _ShardWriter(shard_dir, shard_id)
+    decoder = CopyBinaryDecoder(selected, pg)
 
-    copy_sql = f"""
-    COPY (
-        SELECT *
-            FROM {schema}.{table}
-            WHERE mod(abs(hashtext(({primary_key_col})::text)), %s) = %s
-    ) TO STDOUT (FORMAT BINARY)
-"""
-    with pg.cursor() as cur, cur.copy(copy_sql, (total_shards, shard_id)) as cp:
-        cp.set_types(list(udt_names))
-        MAX_ROWS = 1000
-        MAX_BYTES = 16 * 1024**2  # 16mb
-
-        batch_rows = 0
-        batch_bytes = 0
-        t_read = 0.0  # time waiting inside cp.read_row()
-        t_parse = 0.0  # loop bookkeeping / conversions
-        t_flush = 0.0  # Arrow write + file I/O
-        t0_batch = time.perf_counter()
-
-        while True:
-            t0 = time.perf_counter()
-            row = cp.read_row()
-            t_read += time.perf_counter() - t0
+    where_sql, where_params = shard_plan[shard_id]
+    t0 = time.perf_counter()
+    with pg.cursor() as cur, cur.copy(
+        _copy_sql(schema, table, where_sql, select_sql), where_params
+    ) as cp:
+        for data in cp:
+            shard.write(decoder.feed(data))
+        shard.write(decoder.finish())
+
+    pg.close()
+    seconds = time.perf_counter() - t0
+    print(f"shard {shard_id}: {shard.num_rows} rows in {seconds:.1f}s")
+
+    shard.close()
+    return shard.num_rows, seconds
+
+
+def fetch_shards_helper(
+    shard_ids: list[int],
+    schema: str,
+    table: str,
+    vector_col: str,
+    primary_key_col: str,
+    shard_plan: list[tuple[str, list]],
+    creds,
+    shard_dir: str,
+    connections: int = 4,
+    columns: list[str] | None = None,
+    truncate: dict[str, int] | None = None,
+    halfvec: bool = False,
+    snapshot: str | None = None,  # SharedSnapshot.id every shard reads
+):
+    """
+    Fetch several shards from one process, streaming up to `connections` of
+    them at a time over a pool of async connections; each stream is decoded
+    and written to its own arrow file as its data arrives.
+    Returns (rows, seconds) for the whole batch.
+    """
+    import asyncio, time
+
+    t0 = time.perf_counter()
+    rows = asyncio.run(
+        _fetch_shards_async(
+            shard_ids,
+            schema,
+            table,
+            shard_plan,
+            creds,
+            shard_dir,
+            connections,
+            lambda table_columns: select_columns(
+                table_columns, vector_col, primary_key_col, columns, truncate, halfvec
+            ),
+            snapshot,
+        )
+    )
+    return rows, time.perf_counter() - t0
 
-            if row is None:  # end-of-stream
-                break
 
+async def _fetch_shards_async(
+    shard_ids, schema, table, shard_plan, creds, shard_dir, connections, select, snapshot
+):
+    import asyncio, time
+    from psycopg import sql
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import AsyncConnectionPool
+    from copy_decoder import CopyBinaryDecoder, get_loaders_async
+
+    async def fetch_one(shard_id):
+        async with pool.connection() as conn, conn.transaction():
+            if snapshot:
+                await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                await conn.execute(
+                    sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot))
+                )
+            shard = _ShardWriter(shard_dir, shard_id)
+            decoder = CopyBinaryDecoder(selected, loaders=loaders)
+            where_sql, where_params = shard_plan[shard_id]
             t0 = time.perf_counter()
-            row_size_est = 0
-            for name, val in zip(col_names, row):
-                if name == vector_col:
-                    row_size_est += val.nbytes
-                elif isinstance(val, str):
-                    row_size_est += len(val)
-                else:
-                    row_size_est += 8
-                if isinstance(val, uuid.UUID):
-                    val = str(val)
-                buf[name].append(val)
-            t_parse += time.perf_counter() - t0
-
-            batch_rows += 1
-            batch_bytes += row_size_est
-
-            if (batch_rows >= MAX_ROWS) or (batch_bytes >= MAX_BYTES):
-                t0 = time.perf_counter()
-                writer = _flush(buf, col_names, writer, sink)
-                t_flush += time.perf_counter() - t0
-                dt = time.perf_counter() - t0_batch
-                # print( #prints each batch of 1000
-                #     f"⤵︎ batch {batch_rows:5} rows | "
-                #     f"{batch_bytes/1_048_576:5.1f} MiB | "
-                #     f"{batch_rows/dt:7.0f} r/s | "
-                #     f"{batch_bytes*8/dt/1_000_000:6.1f} Mb/s | "
-                #     f"read {t_read:.2f}s, parse {t_parse:.2f}s, "
-                #     f"flush {t_flush:.2f}s",
-                #     f"{shard_id} shard_id",
-                # )
-                # reset counters
-                batch_rows = batch_bytes = 0
-                t_read = t_parse = t_flush = 0.0
-                t0_batch = time.perf_counter()
-
-        if batch_rows:  # final tail
-            t1 = time.perf_counter()
-            writer = _flush(buf, col_names, writer, sink)
-            t_flush += time.perf_counter() - t1
-            dt = time.perf_counter() - t0_batch
+            async with conn.cursor() as cur, cur.copy(
+                _copy_sql(schema, table, where_sql, select_sql), where_params
+            ) as cp:
+                async for data in cp:
+                    shard.write(decoder.feed(data))
+            shard.write(decoder.finish())
+        shard.close()
+        print(
+            f"shard {shard_id}: {shard.num_rows} rows in {time.perf_counter() - t0:.1f}s"
+        )
+        return shard.num_rows
 
-    pg.close()
+    async def configure(conn):
+        await conn.execute("SET statement_timeout = 0")
 
-    if writer is not None:
-        writer.close()
-    sink.close()
-    tmp.rename(dst)
+    async with AsyncConnectionPool(
+        make_conninfo(**{k: str(v) for k, v in creds.items()}),
+        min_size=1,
+        max_size=connections,
+        kwargs={"autocommit": True},
+        configure=configure,
+        open=False,
+    ) as pool:
+        async with pool.connection() as conn:
+            cur = await conn.execute(COLUMNS_SQL, (schema, table))
+            select_sql, selected = select(await cur.fetchall())
+            loaders = await get_loaders_async(selected, conn)
+
+        rows = await asyncio.gather(*(fetch_one(shard_id) for shard_id in shard_ids))
+    return sum(rows)
 
 
 def embed_to_2d_helper(
@@ -273,17 +1048,33 @@ def embed_to_2d_helper(
     target_gpu_mem: float = 7e9,  # T4 can handle 16GB, so leaving headroom
     n_neighbors: int = 15,
     batch_rows: int = 100_000,
+    reducer: str = "cuml",  # any name in reducers.REDUCERS
+    pre_reduce: str | None = None,  # "pca" or "random" to shrink vectors first
+    pre_reduce_dim: int = 64,
+    pre_reduce_fit_rows: int = 200_000,  # sample size for fitting "pca"
+    landmark_rows: int | None = None,  # fit on this many rows, transform the rest
+    shard_dir: str | None = None,  # where fetch_shards wrote the shards, run_dir if None
+    artifact_dir: str | None = None,  # cache entry to reuse / store the reduction in
+    state_dir: str | None = None,  # keep what incremental refresh needs here
 ):
     """
     Write primary_key, x, y to /cache/xy.arrow
+
+    With an artifact_dir the embedding, the fitted reducers and the kNN graph
+    are kept there, keyed by the reduction settings, and reused when the
+    same settings come around again. With a state_dir the fitted reducers and
+    the normalization are saved there for refresh_projection.
     """
-    import pyarrow.dataset as ds, pyarrow as pa, pyarrow.ipc as ipc
-    import numpy as np, cupy as cp, math, os, tempfile, gc, glob
-    from cuml.manifold import UMAP
+    import pyarrow.dataset as ds, pyarrow as pa
+    import numpy as np, math, os, tempfile, gc, glob, hashlib, json, shutil
+    from reducers import check_reducer, fit_pre_reducer, run_reducer, save_pickle
     import glob
     import multiprocessing as mp
     import time
 
+    check_reducer(reducer)  # before the vectors are copied out
+    shard_dir = shard_dir or run_dir
+
     MAX_WAIT = 60
     step = 2
     waited = 0
@@ -292,7 +1083,7 @@ def embed_to_2d_helper(
         True
     ):  # we wait to make sure all shards' updates have been committed--can't commit in each shard due to volume concurrent writer limit
         vol.reload()
-        arrow_files = glob.glob(os.path.join(run_dir, "*.arrow"))
+        arrow_files = glob.glob(os.path.join(shard_dir, "*.arrow"))
         if len(arrow_files) == num_shards:
             break
         if waited >= MAX_WAIT:
@@ -303,65 +1094,193 @@ def embed_to_2d_helper(
         time.sleep(step)
         waited += step
 
-    ds_obj = ds.dataset(run_dir, format="arrow")
-    num_rows = ds_obj.count_rows()
-    print("num rows: ", num_rows)
+    def settings_key(settings):
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()[:16]
+
+    # the kNN graph only depends on the vectors the reducer sees
+    vector_settings = {"pre_reduce": pre_reduce, "pre_reduce_dim": pre_reduce_dim}
+    model_dir = knn_path = None
+    if artifact_dir is not None:
+        model_settings = {
+            **vector_settings,
+            "reducer": reducer,
+            "n_neighbors": n_neighbors,
+            "landmark_rows": landmark_rows,
+        }
+        model_dir = os.path.join(
+            artifact_dir, "models", settings_key(model_settings)
+        )
+        knn_path = os.path.join(
+            artifact_dir, "knn", f"{settings_key(vector_settings)}.pkl"
+        )
+    embedding_path = model_dir and os.path.join(model_dir, "embedding.npy")
 
-    ds_obj = ds.dataset(run_dir, format="arrow")
-    dim = len(ds_obj.take([0])[vector_col][0])
-    print("vector dim =", dim)
+    if embedding_path and os.path.exists(embedding_path):
+        print("reusing cached embedding", embedding_path)
+        X_low = np.load(embedding_path, mmap_mode="r")
+    else:
+        ds_obj = ds.dataset(shard_dir, format="arrow")
+        num_rows = ds_obj.count_rows()
+        print("num rows: ", num_rows)
+
+        ds_obj = ds.dataset(shard_dir, format="arrow")
+        dim = len(ds_obj.take([0])[vector_col][0])
+        # halfvec shards stay float16 in the memmap when the reducer reads it a
+        # batch at a time and upcasts each one; a reducer fitted on every row at
+        # once gets float32, upcast here batch by batch instead of copied whole
+        # into memory by the reducer
+        vector_type = ds_obj.schema.field(vector_col).type.value_type
+        batched = reducer == "pca" or (
+            landmark_rows is not None and num_rows > landmark_rows
+        )
+        half = pa.types.is_float16(vector_type) and batched
+        dtype = np.float16 if half else np.float32
+        print("vector dim =", dim, np.dtype(dtype).name)
+
+        def to_vectors(column):
+            return column.flatten().to_numpy().reshape(-1, dim)
+
+        projection = None
+        if pre_reduce is not None and pre_reduce_dim < dim:
+            # fit on a random sample spread over every shard, in batches of equal
+            # size so each one has enough rows for partial_fit
+            fit_rows = min(num_rows, pre_reduce_fit_rows)
+            n_components = min(pre_reduce_dim, fit_rows)
+            sample = np.sort(
+                np.random.default_rng(0).choice(num_rows, fit_rows, replace=False)
+            )
+            sample_batches = (
+                to_vectors(
+                    ds_obj.take(ix, columns=[vector_col])[
+                        vector_col
+                    ].combine_chunks()
+                ).astype(np.float32)
+                for ix in np.array_split(sample, max(1, fit_rows // batch_rows))
+            )
+            projection = fit_pre_reducer(
+                pre_reduce, n_components, dim, sample_batches
+            )
+            print(f"{pre_reduce} pre-reduction {dim} -> {n_components} dims")
+        out_dim = dim if projection is None else projection.n_components
 
-    tmp = tempfile.NamedTemporaryFile(prefix="vectors_", suffix=".mmp", delete=False)
-    mmap_path = tmp.name
-    tmp.close()
+        tmp = tempfile.NamedTemporaryFile(
+            prefix="vectors_", suffix=".mmp", delete=False
+        )
+        mmap_path = tmp.name
+        tmp.close()
+
+        mmap = np.memmap(mmap_path, dtype=dtype, mode="w+", shape=(num_rows, out_dim))
+
+        out = 0
+        for batch in ds_obj.scanner(
+            columns=[vector_col], batch_size=batch_rows
+        ).to_batches():
+            vecs = to_vectors(batch.column(vector_col))
+            if projection is not None:
+                vecs = projection.transform(vecs.astype(np.float32))
+            n = vecs.shape[0]
+            mmap[out : out + n, :] = vecs
+            out += n
+
+        options = {"n_neighbors": n_neighbors}
+        if reducer == "cuml":
+            bytes_per_vec = out_dim * 4 + n_neighbors * 8
+            umap_rows = min(num_rows, landmark_rows or num_rows)
+            n_clusters = max(
+                1, math.ceil((bytes_per_vec * umap_rows) / target_gpu_mem)
+            )
+            print("number of clusters", n_clusters)
+            options["n_clusters"] = n_clusters
+
+        ctx = mp.get_context("spawn")
+        if model_dir is None:
+            tmp_out = tempfile.NamedTemporaryFile(suffix=".npy", delete=False)
+            tmp_out.close()
+            result_path = tmp_out.name
+        else:
+            os.makedirs(model_dir, exist_ok=True)
+            # unique, a concurrent run of the same settings may be writing too
+            fd, result_path = tempfile.mkstemp(suffix=".tmp.npy", dir=model_dir)
+            os.close(fd)
+
+        p = ctx.Process(
+            target=run_reducer,
+            args=(
+                reducer,
+                options,
+                mmap_path,
+                (num_rows, out_dim),
+                result_path,
+                landmark_rows,
+                batch_rows,
+                (model_dir or state_dir)
+                and os.path.join(model_dir or state_dir, "reducer.pkl"),
+                knn_path,
+                np.dtype(dtype).name,
+            ),  # we execute UMAP via a child process to avoid python thread heartbeat timeouts
+        )
+        p.start()
+        p.join()
 
-    mmap = np.memmap(mmap_path, dtype=np.float32, mode="w+", shape=(num_rows, dim))
+        if p.exitcode != 0:
+            raise RuntimeError(f"{reducer} subprocess exited with {p.exitcode}")
 
-    out = 0
-    for batch in ds_obj.scanner(
-        columns=[vector_col], batch_size=batch_rows
-    ).to_batches():
-        vecs = batch.column(vector_col).values.to_numpy().reshape(-1, dim)
-        n = vecs.shape[0]
-        mmap[out : out + n, :] = vecs
-        out += n
-
-    bytes_per_vec = dim * 4 + n_neighbors * 8
-    n_clusters = max(1, math.ceil((bytes_per_vec * num_rows) / target_gpu_mem))
-    print("number of clusters", n_clusters)
-
-    umap = UMAP(
-        n_neighbors=n_neighbors,
-        n_components=2,
-        build_algo="nn_descent",
-        build_kwds={"nnd_do_batch": True, "nnd_n_clusters": n_clusters},
-        output_type="numpy",
-    )
-    # X_low = umap.fit_transform(mmap, data_on_host=True).astype(np.float32)
-    ctx = mp.get_context("spawn")
-    tmp_out = tempfile.NamedTemporaryFile(suffix=".npy", delete=False)
-    tmp_out.close()
+        del mmap
+        os.unlink(mmap_path)
 
-    p = ctx.Process(
-        target=_run_umap_worker,
-        args=(
-            mmap_path,
-            (num_rows, dim),
-            n_neighbors,
-            n_clusters,
-            tmp_out.name,
-        ),  # we execute UMAP via a child process to avoid python thread heartbeat timeouts
-    )
-    p.start()
-    p.join()
+        if projection is not None and (model_dir or state_dir):
+            save_pickle(
+                projection, os.path.join(model_dir or state_dir, "pre_reducer.pkl")
+            )
+        if model_dir is not None:
+            os.replace(result_path, embedding_path)  # last, it marks the entry done
+            result_path = embedding_path
+        X_low = np.load(result_path, mmap_mode="r")  # memory-maps the 2-D embedding
+        if model_dir is None:
+            os.unlink(result_path)
 
-    if p.exitcode != 0:
-        raise RuntimeError(f"UMAP subprocess exited with {p.exitcode}")
+    print("UMAP done")
+    xy_path = os.path.join(run_dir, "xy.arrow")
+    pmin, pmax = write_normalized_xy(X_low, xy_path)
 
-    X_low = np.load(tmp_out.name, mmap_mode="r")  # memory-maps the 2-D embedding
-    os.unlink(tmp_out.name)
+    if state_dir is not None:
+        if model_dir is not None:
+            for name in ("reducer.pkl", "pre_reducer.pkl"):
+                if os.path.exists(os.path.join(model_dir, name)):
+                    shutil.copyfile(
+                        os.path.join(model_dir, name), os.path.join(state_dir, name)
+                    )
+        update_refresh_state(state_dir, pmin=list(pmin), pmax=list(pmax))
 
-    print("UMAP done")
+    MAX_ATTEMPTS = 5
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            vol.commit()
+            break
+        except Exception as e:
+            print(f"vol.commit() failed on attempt {attempt}/{MAX_ATTEMPTS}: {e!r}")
+            if attempt == MAX_ATTEMPTS:
+                raise RuntimeError(
+                    "Could not commit volume after several retries"
+                ) from e
+            time.sleep(2 ** (attempt - 1))
+
+    gc.collect()
+    print("done reducing")
+
+
+def write_normalized_xy(X_low, xy_path, chunk_rows=1 << 20):
+    """
+    Clip the (N, 2) embedding to its central percentiles, scale it to 100x100
+    and write x, y, row-index to xy.arrow, a chunk of rows at a time.
+
+    The columns are staged in a memory-mapped scratch file and written as one
+    record batch so the quadtree can still memory-map them contiguously.
+    Returns the (pmin, pmax) the embedding was clipped to.
+    """
+    import numpy as np, pyarrow as pa, pyarrow.ipc as ipc, os, tempfile
+
+    num_rows = len(X_low)
     if num_rows > 100_000:
         pct_low, pct_high = 0.07, 99.3
     elif num_rows > 10_000:
@@ -371,105 +1290,149 @@ def embed_to_2d_helper(
     else:
         pct_low, pct_high = 1.0, 99.0
 
-    pmin, pmax = np.percentile(
-        X_low, [pct_low, pct_high], axis=0
-    )  # clip data into dimensions where most of the data is
+    # clip data into dimensions where most of the data is
+    pmin, pmax = np.stack(
+        [
+            _percentiles(X_low[:, dim], [pct_low, pct_high], chunk_rows)
+            for dim in range(2)
+        ],
+        axis=1,
+    )
 
-    ranges = pmax - pmin
+    scratch = tempfile.NamedTemporaryFile(suffix=".xy", delete=False)
+    scratch.close()
+    staged = np.memmap(scratch.name, dtype=np.float32, mode="w+", shape=(3, num_rows))
+    row_index = staged[2].view(np.int32)  # umap outputs in input order
 
-    X_clip = np.clip(X_low, pmin, pmax)
+    for lo in range(0, num_rows, chunk_rows):
+        hi = min(lo + chunk_rows, num_rows)
+        staged[:2, lo:hi] = normalize_xy(X_low[lo:hi], pmin, pmax).T
+        row_index[lo:hi] = np.arange(lo, hi, dtype=np.int32)
+
+    out_tbl = pa.Table.from_arrays(
+        [
+            pa.array(staged[0], type=pa.float32()),
+            pa.array(staged[1], type=pa.float32()),
+            pa.array(row_index, type=pa.int32()),
+        ],
+        names=["x", "y", "row-index"],  # ix == row-index
+    )
+    with pa.OSFile(xy_path, "wb") as sink:
+        writer = ipc.new_file(sink, out_tbl.schema)
+        writer.write_table(out_tbl)
+        writer.close()
+
+    del out_tbl, staged, row_index
+    os.unlink(scratch.name)
+    return pmin, pmax
 
-    X_norm = (X_clip - pmin) / ranges * 100.0
-    X_norm = np.clip(X_norm, 0.0, 100.0)
+
+def normalize_xy(X_low, pmin, pmax):
+    """Clip (n, 2) embedding rows to [pmin, pmax] and scale them to 100x100."""
+    import numpy as np
+
+    ranges = pmax - pmin
 
     # jitter the data which was moved to the edges
     eps_jitter = 0.9
     tol_data = 1e-6
 
+    X_clip = np.clip(X_low, pmin, pmax)
+
+    X_norm = (X_clip - pmin) / ranges * 100.0
+    X_norm = np.clip(X_norm, 0.0, 100.0)
+
     bottom_clip = X_clip[:, 1] <= pmin[1] + tol_data
     top_clip = X_clip[:, 1] >= pmax[1] - tol_data
     left_clip = X_clip[:, 0] <= pmin[0] + tol_data
     right_clip = X_clip[:, 0] >= pmax[0] - tol_data
 
     X_norm[bottom_clip, 1] = np.random.uniform(0, eps_jitter, size=bottom_clip.sum())
-    X_norm[top_clip, 1] = np.random.uniform(100 - eps_jitter, 100, size=top_clip.sum())
+    X_norm[top_clip, 1] = np.random.uniform(
+        100 - eps_jitter, 100, size=top_clip.sum()
+    )
     X_norm[left_clip, 0] = np.random.uniform(0, eps_jitter, size=left_clip.sum())
     X_norm[right_clip, 0] = np.random.uniform(
         100 - eps_jitter, 100, size=right_clip.sum()
     )
+    return X_norm
 
-    idx = np.arange(num_rows, dtype=np.int32)
-    perm = np.random.permutation(num_rows)
-    x_shuf = X_norm[perm, 0]
-    y_shuf = X_norm[perm, 1]
-    idx_shuf = idx[perm]
 
-    out_tbl = pa.Table.from_arrays(
-        [
-            pa.array(x_shuf, type=pa.float32()),
-            pa.array(y_shuf, type=pa.float32()),
-            pa.array(idx_shuf, type=pa.int32()),  # umap outputs in same order as input
-        ],
-        names=["x", "y", "row-index"],  # ix == row-index
+def _percentiles(column, qs, chunk_rows):
+    """
+    np.percentile(column, qs) for a float32 column, reading it a chunk at a
+    time. The order statistics come from a two pass radix select, so memory
+    doesn't grow with the column.
+    """
+    import numpy as np
+
+    n = len(column)
+    q = np.true_divide(np.asarray(qs, dtype=np.float64), 100)
+
+    # same virtual index and interpolation as np.percentile's "linear" method
+    virtual = (n - 1) * q
+    prev = np.floor(virtual)
+    gamma = virtual - prev
+    prev = np.minimum(prev.astype(np.int64), n - 1)
+    stats = _order_statistics(
+        lambda: (column[lo : lo + chunk_rows] for lo in range(0, n, chunk_rows)),
+        np.concatenate([prev, np.minimum(prev + 1, n - 1)]),
     )
+    a, b = stats[: len(q)], stats[len(q) :]
 
-    xy_path = os.path.join(run_dir, "xy.arrow")
-    with pa.OSFile(xy_path, "wb") as sink:
-        writer = ipc.new_file(sink, out_tbl.schema)
-        writer.write_table(out_tbl)
-        writer.close()
+    diff = np.subtract(b, a)
+    out = np.add(a, diff * gamma)
+    np.subtract(b, diff * (1 - gamma), out=out, where=gamma >= 0.5, casting="unsafe")
+    return out
 
-    MAX_ATTEMPTS = 5
-    for attempt in range(1, MAX_ATTEMPTS + 1):
-        try:
-            vol.commit()
-            break
-        except Exception as e:
-            print(f"vol.commit() failed on attempt {attempt}/{MAX_ATTEMPTS}: {e!r}")
-            if attempt == MAX_ATTEMPTS:
-                raise RuntimeError(
-                    "Could not commit volume after several retries"
-                ) from e
-            time.sleep(2 ** (attempt - 1))
 
-    del mmap
-    os.unlink(mmap_path)
-    gc.collect()
-    cp.get_default_memory_pool().free_all_blocks()
-    print("done reducing")
+def _order_statistics(chunks, ranks):
+    """
+    Exact values at the given 0-based ranks of a float32 column. chunks() yields
+    the column in pieces; each pass histograms 16 bits of the order preserving
+    uint32 keys, high half first.
+    """
+    import numpy as np
 
+    ranks = np.asarray(ranks, dtype=np.int64)
 
-def failed(supabase, projection_id):
-    supabase.table("projections").update({"status": "failed"}).eq(
-        "projection_id", projection_id
-    ).execute()
+    high = np.zeros(1 << 16, dtype=np.int64)
+    for chunk in chunks():
+        high += np.bincount(_float_keys(chunk) >> 16, minlength=1 << 16)
+    cum = np.cumsum(high)
+    prefixes = np.searchsorted(cum, ranks, side="right")
+    below = np.concatenate([[0], cum])[prefixes]  # ranks before each prefix
 
+    low = {p: np.zeros(1 << 16, dtype=np.int64) for p in np.unique(prefixes)}
+    for chunk in chunks():
+        keys = _float_keys(chunk)
+        top = keys >> 16
+        for p, hist in low.items():
+            hist += np.bincount(keys[top == p] & 0xFFFF, minlength=1 << 16)
 
-def _run_umap_worker(
-    mmap_path: str,
-    shape: tuple[int, int],
-    n_neighbors: int,
-    n_clusters: int,
-    result_path: str,
-) -> None:
-    """
-    Child process entry point.
-    Reads the memory-map, runs cuML UMAP, writes a .npy file with (N,2) floats.
-    """
-    # Everything heavy is imported **inside** the child so that the fork/spawn
-    # does not pull GPU state into the parent.
+    keys = [
+        (int(p) << 16) | int(np.searchsorted(np.cumsum(low[p]), r - b, side="right"))
+        for r, p, b in zip(ranks, prefixes, below)
+    ]
+    return _keys_to_floats(keys)
+
+
+def _float_keys(values):
+    """uint32 keys that sort like the float32 values"""
     import numpy as np
-    from cuml.manifold import UMAP
 
-    mmap = np.memmap(mmap_path, dtype=np.float32, mode="r", shape=shape)
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    return np.where(bits >> 31, ~bits, bits | np.uint32(0x80000000))
 
-    umap = UMAP(
-        n_neighbors=n_neighbors,
-        n_components=2,
-        build_algo="nn_descent",
-        build_kwds={"nnd_do_batch": True, "nnd_n_clusters": n_clusters},
-        output_type="numpy",
-    )
 
-    X_low = umap.fit_transform(mmap, data_on_host=True).astype(np.float32)
-    np.save(result_path, X_low)
+def _keys_to_floats(keys):
+    import numpy as np
+
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.where(keys >> 31, keys & np.uint32(0x7FFFFFFF), ~keys).view(np.float32)
+
+
+def failed(supabase, projection_id):
+    supabase.table("projections").update({"status": "failed"}).eq(
+        "projection_id", projection_id
+    ).execute()
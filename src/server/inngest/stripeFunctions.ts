@@ -4,6 +4,7 @@ import Stripe from "stripe";
 import { type z } from "zod";
 import { databases, db, projections, users } from "../db";
 import { deleteBucketFolder } from "../utils/dbUtils";
+import { deleteProjectionState } from "../utils/callReduce";
 import { inngest } from "./client";
 import {
   StripeHookEnvelope,
@@ -104,6 +105,7 @@ export const subscriptionUpdated = inngest.createFunction(
         for (const proj of dbProjections) {
           const projectionId = proj.projectionId;
           await deleteBucketFolder("quadtree-tiles", projectionId);
+          deleteProjectionState(projectionId);
         }
         await db
           .delete(projections)
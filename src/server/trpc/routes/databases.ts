@@ -8,6 +8,7 @@ import { db } from "~/server/db";
 import { r2 } from "~/server/db/r2Client";
 import { databases, projections, users } from "~/server/db/schema";
 import { deleteBucketFolder, getUserIdByKindeId } from "~/server/utils/dbUtils";
+import { deleteProjectionState } from "~/server/utils/callReduce";
 import { testRemoteConnection } from "~/server/trpc/remoteConnectionUtils";
 import { protectedProcedure, router } from "../trpc";
 
@@ -116,6 +117,7 @@ export const databasesRouter = router({
       for (const proj of dbProjections) {
         const projectionId = proj.projectionId;
         await deleteBucketFolder("quadtree-tiles", projectionId);
+        deleteProjectionState(projectionId);
       }
     }),
   testRestrictedConnection: protectedProcedure
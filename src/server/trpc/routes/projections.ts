@@ -1,7 +1,7 @@
 import { TRPCError } from "@trpc/server";
 import { and, eq } from "drizzle-orm/expressions";
 import { z } from "zod";
-import { reduceTable } from "~/server/utils/callReduce";
+import { deleteProjectionState, reduceTable } from "~/server/utils/callReduce";
 import { db } from "~/server/db";
 import { projections, users } from "~/server/db/schema";
 import { deleteBucketFolder } from "~/server/utils/dbUtils";
@@ -21,6 +21,7 @@ export const projectionsRouter = router({
         .where(eq(projections.projectionId, input.projectionId));
 
       await deleteBucketFolder("quadtree-tiles", input.projectionId);
+      deleteProjectionState(input.projectionId);
     }),
   listActiveDbProjections: protectedProcedure
     .input(
@@ -68,6 +69,8 @@ export const projectionsRouter = router({
         displayName: z.string(),
         remainingRows: z.number(),
         trimmedCols: z.array(z.string()),
+        columns: z.array(z.string()).optional(),
+        truncate: z.record(z.string(), z.number().int().positive()).optional(),
       }),
     )
     .mutation(async ({ input, ctx }) => {
@@ -83,6 +86,8 @@ export const projectionsRouter = router({
           displayName,
           trimmedCols,
           remainingRows,
+          columns,
+          truncate,
         } = input;
 
         await db
@@ -102,7 +107,9 @@ export const projectionsRouter = router({
             schema: schema,
             table: table,
             numberPoints: numberPoints,
-            columns: trimmedCols,
+            columns: columns
+              ? trimmedCols.filter((col) => columns.includes(col))
+              : trimmedCols,
             status: "creating",
           })
           .returning({ projectionId: projections.projectionId });
@@ -116,6 +123,8 @@ export const projectionsRouter = router({
           numberPoints,
           databaseId,
           remainingRows,
+          columns,
+          truncate,
         });
 
         return { projectionId: insertedProjection!.projectionId };
@@ -4,6 +4,7 @@ import { databases, db, projections, users } from "~/server/db";
 import { deleteUser, getToken } from "~/server/utils/kindeUtils";
 import { protectedProcedure, router } from "../trpc";
 import { deleteBucketFolder } from "~/server/utils/dbUtils";
+import { deleteProjectionState } from "~/server/utils/callReduce";
 
 const stripe = new Stripe(process.env.STRIPE_SECRET_KEY!);
 
@@ -83,6 +84,7 @@ export const usersRouter = router({
       for (const proj of dbProjections) {
         const projectionId = proj.projectionId;
         await deleteBucketFolder("quadtree-tiles", projectionId);
+        deleteProjectionState(projectionId);
       }
     }
 
@@ -7,6 +7,10 @@ interface reduceTableProps {
   numberPoints: number;
   databaseId: string;
   remainingRows: number;
+  // only fetch these columns (the key and vector columns always come along)
+  columns?: string[];
+  // cut these text columns to at most this many characters in the database
+  truncate?: Record<string, number>;
 }
 
 export function reduceTable({
@@ -18,6 +22,8 @@ export function reduceTable({
   numberPoints,
   databaseId,
   remainingRows,
+  columns,
+  truncate,
 }: reduceTableProps) {
   const endpointUrl = new URL(process.env.MODAL_ENDPOINT_URL!);
 
@@ -29,6 +35,34 @@ export function reduceTable({
   endpointUrl.searchParams.append("database_id", databaseId);
   endpointUrl.searchParams.append("total_rows", numberPoints.toString());
   endpointUrl.searchParams.append("remaining_rows", remainingRows.toString());
+  if (columns) {
+    endpointUrl.searchParams.append("columns", columns.join(","));
+  }
+  if (truncate && Object.keys(truncate).length > 0) {
+    endpointUrl.searchParams.append(
+      "truncate",
+      Object.entries(truncate)
+        .map(([column, length]) => `${column}:${length}`)
+        .join(","),
+    );
+  }
+
+  try {
+    void fetch(endpointUrl.toString(), {
+      headers: {
+        "Modal-Key": process.env.MODAL_KEY!,
+        "Modal-Secret": process.env.MODAL_SECRET!,
+      },
+    });
+  } catch (err) {
+    console.error("Error triggering Modal function:", err);
+  }
+}
+
+// drops the refresh state kept on the modal volume for a deleted projection
+export function deleteProjectionState(projectionId: string) {
+  const endpointUrl = new URL(process.env.MODAL_DELETE_ENDPOINT_URL!);
+  endpointUrl.searchParams.append("projection_id", projectionId);
 
   try {
     void fetch(endpointUrl.toString(), {